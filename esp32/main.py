@@ -4,6 +4,7 @@ import time
 import ntptime
 import machine
 from machine import UART, Pin
+import ubinascii
 import ujson
 import urequests
 
@@ -12,6 +13,9 @@ from hmc5883l import HMC5883L
 
 # Needs file imu.py in the same folder
 from imu import MPU6050
+
+# Needs file wire.py in the same folder
+import wire
 from machine import I2C
 import math
 
@@ -302,29 +306,50 @@ def get_sensors_data():
 
     return sensors_data
 
-def send_sensors_data(sensors_data, service_url):
+# Sent on every request so the server metrics tell the robots apart, set by
+# main_program() from "robotId" in config.json or the chip id
+HEADERS = {}
+
+def set_robot_id(robot_id=None):
+    HEADERS['X-Robot-Id'] = robot_id or ubinascii.hexlify(machine.unique_id()).decode()
+
+def send_sensors_data(sensors_data, service_url, wire_format="binary"):
+    # "binary" packs the record in a reused 30 bytes buffer (see wire.py),
+    # "json" is the old format, bigger and with more allocations
     request_url = service_url + "/sensors"
-    headers = {'Content-Type': 'application/json'}
 
     try:
-        post_data = ujson.dumps(sensors_data)
+        if wire_format == "binary":
+            headers = dict(HEADERS, **{'Content-Type': wire.CONTENT_TYPE})
+            post_data = wire.encode(sensors_data)
+        else:
+            headers = dict(HEADERS, **{'Content-Type': 'application/json'})
+            post_data = ujson.dumps(sensors_data)
         try:
             res = urequests.post(request_url, headers=headers, data=post_data)
             return res
         except Exception as e:
             print("⚠️ Error sending data to the server:", e)
             return None
-    except ValueError as e:
-        print("⚠️ Error encoding sensors to JSON:", e)
+    except (ValueError, TypeError) as e:
+        print("⚠️ Error encoding sensors data:", e)
         return None
 
 ## Run instructions
 
-def get_instructions(service_url):
+# Seconds the server holds GET /instructions waiting for a new plan (long polling).
+# It also sets the pace of the main loop, the sensors are sent once per request.
+INSTRUCTIONS_WAIT_SEC = 2
+
+def get_instructions(service_url, wait=0):
+    # With wait > 0 the server answers as soon as the LLM publishes instructions
+    # instead of making us poll again later
     request_url = service_url + "/instructions"
+    if wait > 0:
+        request_url += "?wait=" + str(wait)
 
     try:
-        res = urequests.get(request_url)
+        res = urequests.get(request_url, headers=HEADERS)
         try:
             return json.loads(res.text)
         except ValueError:
@@ -334,6 +359,18 @@ def get_instructions(service_url):
         print("⚠️ Error connecting to the instruction server:", e)
         return None
 
+def ack_instructions(service_url, plan_id):
+    # Tell the server the plan was executed so it is not kept as pending delivery
+    request_url = service_url + "/instructions/" + str(plan_id) + "/ack"
+
+    try:
+        res = urequests.post(request_url, headers=HEADERS)
+        res.close()
+        return True
+    except Exception as e:
+        print("⚠️ Error acknowledging instructions:", e)
+        return False
+
 def stop():
     uart.write(STOP)
     time.sleep(0.2)
@@ -598,6 +635,7 @@ def execute_instructions(instructions):
 def main_program():
     # Get config from config.json
     config = load_config()
+    set_robot_id(config.get("robotId"))
     # Configure wifi
     sta_if = wifi(config["wifi"]["essid"], config["wifi"]["password"])
     # Configure time
@@ -612,22 +650,28 @@ def main_program():
     turn_right(10)
 
     while True:
-        time.sleep(2)
         try:
             time.sleep(0.1)
         
             sensors_data = get_sensors_data()
             #print("sending sensors data")
             print(sensors_data)
-            send_sensors_data(sensors_data, config["serviceUrl"])
+            send_sensors_data(sensors_data, config["serviceUrl"], config.get("wireFormat", "binary"))
             #print("getting instructions")
-            instructions = get_instructions(config["serviceUrl"])
+            # Long poll replaces the fixed sleep between iterations
+            instructions = get_instructions(config["serviceUrl"], wait=INSTRUCTIONS_WAIT_SEC)
             # print("instructions", instructions)
             if instructions != None:
                 if not "error" in instructions:
                     execute_instructions(instructions)
+                    if "plan_id" in instructions:
+                        ack_instructions(config["serviceUrl"], instructions["plan_id"])
+            else:
+                # Server not reachable, do not retry in a tight loop
+                time.sleep(2)
         except Exception as e:
             print("⚠️ Error in main loop:", e)
+            time.sleep(2)
 
 
 main_program()
@@ -0,0 +1,50 @@
+# Binary encoding of the sensors record sent to the server (server/wire.py decodes it).
+# Fixed layout, little endian, version 1 (30 bytes):
+#   version      B   always 1
+#   flags        B   bit 0: distance is valid
+#   year         H
+#   month..second 5B
+#   distance     f   cm
+#   battery      f   %, -1 if it could not be read
+#   compass      f   degrees
+#   bumpers      B   0 no collision, 1 right, 2 left, 3 front, 255 unknown
+#   cliff        4h  left, front_left, front_right, right (-1 if it could not be read)
+try:
+    from ustruct import pack_into, calcsize
+except ImportError:
+    # CPython, used by the server benchmarks
+    from struct import pack_into, calcsize
+
+VERSION = 1
+FORMAT = "<BBHBBBBBfffB4h"
+SIZE = calcsize(FORMAT)
+CONTENT_TYPE = "application/x-vikare-sensors"
+
+FLAG_DISTANCE = 1
+
+BUMPERS = {False: 0, 'right': 1, 'left': 2, 'front': 3}
+BUMPERS_UNKNOWN = 255
+
+# Reused on every call so encoding does not allocate a new buffer
+_buffer = bytearray(SIZE)
+
+def encode(sensors_data, buffer=_buffer):
+    # sensors_data as returned by main.py:get_sensors_data. Returns buffer filled in.
+    distance = sensors_data['distance']
+    flags = 0
+    if distance is not None:
+        flags |= FLAG_DISTANCE
+    else:
+        distance = 0.0
+
+    # time is "YYYY-MM-DD-HH-MM-SS"
+    t = sensors_data['time']
+    cliff = sensors_data['cliff']
+
+    pack_into(FORMAT, buffer, 0,
+              VERSION, flags,
+              int(t[0:4]), int(t[5:7]), int(t[8:10]), int(t[11:13]), int(t[14:16]), int(t[17:19]),
+              distance, sensors_data['battery'], sensors_data['compass'],
+              BUMPERS.get(sensors_data['bumpers'], BUMPERS_UNKNOWN),
+              cliff['left'], cliff['front_left'], cliff['front_right'], cliff['right'])
+    return buffer
@@ -0,0 +1,145 @@
+#!/usr/bin/python
+# Load benchmark for the sensors ingest servers.
+#
+# Against running servers:
+#   python bench_ingest.py http://localhost:5000 http://localhost:5001
+# Starting the Flask development server and the ASGI server locally on a temporary data dir:
+#   python bench_ingest.py --spawn
+import argparse
+import http.client
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import json
+from urllib.parse import urlparse
+
+# Same shape as esp32/main.py:get_sensors_data
+READING = {
+    "distance": 12.5,
+    "battery": 87.3,
+    "compass": 181,
+    "bumpers": False,
+    "time": "2025-01-01-12-00-00",
+    "cliff": {"left": 0, "front_left": 0, "front_right": 0, "right": 0},
+}
+
+def worker(url, path, body, count, latencies, errors):
+    target = urlparse(url)
+    connection = http.client.HTTPConnection(target.hostname, target.port, timeout=30)
+    headers = {"Content-Type": "application/json"}
+    for _ in range(count):
+        start = time.perf_counter()
+        try:
+            connection.request("POST", path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+                continue
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(str(e))
+            connection.close()
+            connection = http.client.HTTPConnection(target.hostname, target.port, timeout=30)
+            continue
+        latencies.append(time.perf_counter() - start)
+    connection.close()
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def run(url, requests, concurrency, batch):
+    if batch > 1:
+        path, body = "/sensors/batch", json.dumps([READING] * batch)
+    else:
+        path, body = "/sensors", json.dumps(READING)
+
+    latencies, errors = [], []
+    per_thread = requests // concurrency
+    threads = [threading.Thread(target=worker, args=(url, path, body, per_thread, latencies, errors))
+               for _ in range(concurrency)]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    if not latencies:
+        return {"url": url, "errors": len(errors)}
+    return {
+        "url": url,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+def wait_ready(url, timeout=15):
+    target = urlparse(url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection(target.hostname, target.port, timeout=1)
+            connection.request("GET", "/instructions")
+            connection.getresponse().read()
+            connection.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not start")
+
+def spawn(script, port, directory, workers):
+    # Data and state of its own, so the servers share nothing with each other or with
+    # a deployment on the same machine
+    env = dict(os.environ, PORT=str(port), SERVER_WORKERS=str(workers),
+               VIKARE_DATA_DIR=os.path.join(directory, "data"), VIKARE_STATE_DIR=os.path.join(directory, "shm"))
+    here = os.path.dirname(os.path.abspath(__file__))
+    # New session so the Flask reloader child is killed too
+    return subprocess.Popen([sys.executable, os.path.join(here, script)], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /sensors ingest")
+    parser.add_argument("urls", nargs="*", help="base URLs of the servers to compare")
+    parser.add_argument("--spawn", action="store_true",
+                        help="start sensors.py and sensors_asgi.py locally and compare them")
+    parser.add_argument("--workers", type=int, default=2, help="ASGI workers with --spawn")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--batch", type=int, default=1,
+                        help="readings per request, more than 1 uses /sensors/batch")
+    args = parser.parse_args()
+
+    processes = []
+    urls = list(args.urls)
+    if args.spawn:
+        data_dir = tempfile.mkdtemp(prefix="vikare-bench-")
+        processes.append(spawn("sensors.py", 5101, os.path.join(data_dir, "flask"), 1))
+        processes.append(spawn("sensors_asgi.py", 5102, os.path.join(data_dir, "asgi"), args.workers))
+        urls += ["http://127.0.0.1:5101", "http://127.0.0.1:5102"]
+
+    try:
+        for url in urls:
+            wait_ready(url)
+        print(f"{'url':<28} {'requests':>8} {'errors':>6} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+        for url in urls:
+            result = run(url, args.requests, args.concurrency, args.batch)
+            if "rps" not in result:
+                print(f"{url:<28} all requests failed ({result['errors']} errors)")
+                continue
+            print(f"{url:<28} {result['requests']:>8} {result['errors']:>6} {result['rps']:>9.1f} "
+                  f"{result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f}")
+    finally:
+        for process in processes:
+            os.killpg(process.pid, signal.SIGTERM)
+
+if __name__ == '__main__':
+    main()
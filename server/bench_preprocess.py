@@ -0,0 +1,102 @@
+#!/usr/bin/python
+# Image preprocessing time per LLM decision, before and after encoding the resolutions
+# at capture time (variants.py):
+#   before  image.py writes the full frame, llm.py reads it back, decodes, resizes and
+#           writes it again (resize_image), and the ollama client reads and base64
+#           encodes the file
+#   after   image.py encodes every variant from the decoded frame in its pool and keeps
+#           them in memory, llm.py gets the "llm" one over the frame socket (framebuffer.py)
+# Uses a synthetic frame, pass --width/--height for the camera resolution.
+#
+#   python bench_preprocess.py
+import argparse
+import base64
+import os
+import tempfile
+import time
+import cv2
+import numpy as np
+
+def synthetic_frame(width, height):
+    # Smooth gradients, shapes and sensor noise, compresses like a camera frame
+    y, x = np.mgrid[0:height, 0:width]
+    frame = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=2)
+    frame = frame.astype(np.uint8)
+    cv2.circle(frame, (width // 3, height // 2), height // 5, (20, 20, 20), -1)
+    cv2.rectangle(frame, (width // 2, height // 4), (width * 3 // 4, height * 3 // 4), (200, 180, 40), -1)
+    noise = np.random.default_rng(0).integers(-8, 8, frame.shape, dtype=np.int16)
+    return np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+def timed(function, runs):
+    # Median seconds of a call
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+def before(frame, directory):
+    path = os.path.join(directory, "frame.jpg")
+    resized_path = os.path.join(directory, "resized_frame.jpg")
+
+    def capture():
+        cv2.imwrite(path, frame)
+
+    def decision():
+        # llm.py resize_image, writing next to the frame
+        img = cv2.imread(path)
+        dim = (int(img.shape[1] * 0.25), int(img.shape[0] * 0.25))
+        cv2.imwrite(resized_path, cv2.resize(img, dim, interpolation=cv2.INTER_AREA))
+        # What the ollama client does with a path
+        with open(resized_path, "rb") as f:
+            return base64.b64encode(f.read())
+
+    return capture, decision
+
+def after(frame, directory):
+    # Imported here so the frame socket goes to the temporary directory
+    os.environ["VIKARE_STATE_DIR"] = directory
+    from framebuffer import FrameClient, FrameRing, FrameServer
+    from frames import FrameStore
+    from variants import VariantEncoder
+
+    ring = FrameRing()
+    server = FrameServer({"front": ring}, os.path.join(directory, "frames.sock"))
+    client = FrameClient(os.path.join(directory, "frames.sock"))
+    encoder = VariantEncoder()
+    store = FrameStore(os.path.join(directory, "images"), max_count=10)
+
+    def capture():
+        jpegs = encoder.encode(frame)
+        ring.put(jpegs, time.time())
+        store.save(jpegs["full"], time.time())
+
+    def decision():
+        metadata, jpeg = client.latest(variant="llm")
+        return base64.b64encode(jpeg)
+
+    return capture, decision
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    frame = synthetic_frame(args.width, args.height)
+    print(f"frame {args.width}x{args.height}, median of {args.runs} runs")
+    print(f"{'pipeline':<8} {'capture ms':>11} {'decision ms':>12} {'total ms':>9} {'bytes sent':>11}")
+    for name, pipeline in (("before", before), ("after", after)):
+        with tempfile.TemporaryDirectory() as directory:
+            capture, decision = pipeline(frame, directory)
+            capture()
+            sent = len(decision())
+            capture_time = timed(capture, args.runs)
+            decision_time = timed(decision, args.runs)
+            print(f"{name:<8} {capture_time * 1000:>11.2f} {decision_time * 1000:>12.2f} "
+                  f"{(capture_time + decision_time) * 1000:>9.2f} {sent:>11}")
+
+if __name__ == '__main__':
+    main()
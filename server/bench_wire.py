@@ -0,0 +1,64 @@
+#!/usr/bin/python
+# Size, encode time and allocations of the sensors record: JSON vs binary (wire.py).
+# Runs the firmware encoder (esp32/wire.py) on CPython, so times are only relative,
+# the ratio is what to expect on the ESP32.
+#
+#   python bench_wire.py
+import importlib.util
+import json
+import os
+import timeit
+import tracemalloc
+
+import wire
+
+FIRMWARE_WIRE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "esp32", "wire.py")
+
+# Same shape as esp32/main.py:get_sensors_data
+READING = {
+    "distance": 12.5,
+    "battery": 87.3,
+    "compass": 181.25,
+    "bumpers": False,
+    "time": "2025-01-01-12-00-00",
+    "cliff": {"left": 0, "front_left": 12, "front_right": 0, "right": -1},
+}
+
+def load_firmware_encoder():
+    spec = importlib.util.spec_from_file_location("firmware_wire", FIRMWARE_WIRE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def allocated(function, calls=1000):
+    # Bytes allocated per call, a proxy of the GC pressure on the ESP32
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    results = [function() for _ in range(calls)]
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del results
+    return (peak - before) / calls
+
+def main(calls=100000):
+    firmware = load_firmware_encoder()
+    # Copy because the firmware reuses its buffer
+    binary = bytes(firmware.encode(READING))
+    text = json.dumps(READING)
+
+    assert wire.decode(binary) == [READING], wire.decode(binary)
+
+    json_time = timeit.timeit(lambda: json.dumps(READING), number=calls) / calls
+    binary_time = timeit.timeit(lambda: firmware.encode(READING), number=calls) / calls
+    json_decode = timeit.timeit(lambda: json.loads(text), number=calls) / calls
+    binary_decode = timeit.timeit(lambda: wire.decode(binary), number=calls) / calls
+
+    print(f"{'format':<8} {'bytes':>6} {'encode us':>10} {'alloc B/encode':>15} {'decode us':>10}")
+    print(f"{'json':<8} {len(text):>6} {json_time * 1e6:>10.2f} "
+          f"{allocated(lambda: json.dumps(READING)):>15.0f} {json_decode * 1e6:>10.2f}")
+    print(f"{'binary':<8} {len(binary):>6} {binary_time * 1e6:>10.2f} "
+          f"{allocated(lambda: firmware.encode(READING)):>15.0f} {binary_decode * 1e6:>10.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+#!/usr/bin/python
+# Camera capture helpers used by image.py
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+import cv2
+from framediff import ChangeDetector
+from scheduler import Ticker
+from variants import VariantEncoder
+
+# Reconnection delay when the stream fails: doubles on every failed attempt up to the
+# maximum, with jitter so several cameras do not reconnect in lockstep
+RECONNECT_MIN_DELAY_SEC = float(os.environ.get("RECONNECT_MIN_DELAY_SEC", 0.5))
+RECONNECT_MAX_DELAY_SEC = float(os.environ.get("RECONNECT_MAX_DELAY_SEC", 30))
+# A read() or open taking longer than this is considered hung and the stream reopened
+DECODE_TIMEOUT_SEC = float(os.environ.get("DECODE_TIMEOUT_SEC", 10))
+# Seconds between watchdog checks
+WATCHDOG_INTERVAL_SEC = 1
+# Readers abandoned by the watchdog that may still be blocked, each with its thread and
+# FFmpeg connection: at this many no new reader is started until one of them returns
+MAX_ABANDONED_READERS = int(os.environ.get("MAX_ABANDONED_READERS", 3))
+
+def reconnect_delay(attempt, minimum=RECONNECT_MIN_DELAY_SEC, maximum=RECONNECT_MAX_DELAY_SEC):
+    # Exponential backoff from 0.5 to 1.5 times the nominal delay of the attempt (0 first)
+    return min(minimum * 2 ** attempt, maximum) * random.uniform(0.5, 1.5)
+
+class FrameGrabber:
+    """
+    Thread reading a video stream as fast as it is decoded.
+
+    Keeps only the newest frame, so the FFmpeg/RTSP buffer never fills up and
+    whoever samples latest() gets what the camera sees now, not seconds ago.
+
+    The stream is supervised: failed reads reconnect with backoff, and a watchdog
+    replaces the reader thread when read() hangs, since a blocked read() cannot be
+    interrupted. The abandoned thread exits when its read() eventually returns. The
+    replacement waits the same backoff as a failed read, and is not started while
+    MAX_ABANDONED_READERS abandoned threads are still blocked.
+
+    Args:
+        url (str): stream URL for cv2.VideoCapture
+        name (str): for the logs
+    """
+
+    def __init__(self, url, name="camera"):
+        self.url = url
+        self.name = name
+        self.lock = threading.Lock()
+        self.frame = None
+        self.frame_time = None
+        # Frames decoded since start, also identifies each frame
+        self.frame_count = 0
+        self.errors = 0
+        self.reconnects = 0
+        self.hangs = 0
+        # Seconds spent in successful read() calls, for the mean decode latency
+        self.decode_seconds = 0.0
+        # Monotonic time the reader started its current open or read(), None while it
+        # sleeps before reconnecting
+        self.busy_since = None
+        # Failed reads and hangs since the last frame, for the backoff
+        self.attempt = 0
+        # Only the reader of the current generation publishes frames
+        self.generation = 0
+        # Generations abandoned by the watchdog whose thread is still blocked
+        self.abandoned = set()
+        self.restart_pending = False
+        self._start_reader()
+        self.watchdog = threading.Thread(target=self._watch, name=f"watchdog-{name}", daemon=True)
+        self.watchdog.start()
+
+    def _start_reader(self, delay=0):
+        # New reader thread, opening the stream after delay seconds
+        self.generation += 1
+        self.busy_since = None if delay else time.monotonic()
+        thread = threading.Thread(target=self._run, args=(self.generation, delay), name=f"grabber-{self.name}",
+                                  daemon=True)
+        thread.start()
+
+    def _open(self):
+        # Timeouts of the FFmpeg backend, the watchdog covers builds that ignore them
+        timeout_ms = int(DECODE_TIMEOUT_SEC * 1000)
+        return cv2.VideoCapture(self.url, cv2.CAP_FFMPEG, [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, timeout_ms,
+                                                          cv2.CAP_PROP_READ_TIMEOUT_MSEC, timeout_ms])
+
+    def _run(self, generation, delay=0):
+        try:
+            if delay:
+                time.sleep(delay)
+                if generation != self.generation:
+                    return
+                self.busy_since = time.monotonic()
+            self._read(generation)
+        finally:
+            # Returned from the call the watchdog gave up on
+            self.abandoned.discard(generation)
+
+    def _read(self, generation):
+        capture = self._open()
+        while generation == self.generation:
+            self.busy_since = time.monotonic()
+            start = time.perf_counter()
+            ret, frame = capture.read()
+            elapsed = time.perf_counter() - start
+            if generation != self.generation:
+                # Replaced by the watchdog while blocked
+                break
+
+            if not ret:
+                self.errors += 1
+                delay = reconnect_delay(self.attempt)
+                self.attempt += 1
+                print(f"[{self.name}] ❌ Error getting the image from {self.url}, "
+                      f"reconnecting in {delay:.1f}s", flush=True)
+                capture.release()
+                self.busy_since = None
+                time.sleep(delay)
+                if generation != self.generation:
+                    return
+                self.reconnects += 1
+                self.busy_since = time.monotonic()
+                capture = self._open()
+                continue
+
+            self.attempt = 0
+            frame_time = time.time()
+            with self.lock:
+                self.frame = frame
+                self.frame_time = frame_time
+                self.frame_count += 1
+                self.decode_seconds += elapsed
+        capture.release()
+
+    def _watch(self):
+        while True:
+            time.sleep(WATCHDOG_INTERVAL_SEC)
+            if self.restart_pending:
+                if len(self.abandoned) >= MAX_ABANDONED_READERS:
+                    # Wait for one of them to return
+                    continue
+                self.restart_pending = False
+                delay = reconnect_delay(self.attempt)
+                self.attempt += 1
+                self.reconnects += 1
+                print(f"[{self.name}] Reopening the stream in {delay:.1f}s", flush=True)
+                self._start_reader(delay)
+                continue
+
+            busy_since = self.busy_since
+            if busy_since is not None and time.monotonic() - busy_since > DECODE_TIMEOUT_SEC:
+                self.hangs += 1
+                # Abandoned: it exits when its call returns, it will not publish frames
+                self.abandoned.add(self.generation)
+                self.generation += 1
+                self.busy_since = None
+                self.restart_pending = True
+                print(f"[{self.name}] ❌ No frame from {self.url} in {DECODE_TIMEOUT_SEC}s, "
+                      f"{len(self.abandoned)} blocked readers", flush=True)
+
+    def latest(self):
+        """
+        Newest decoded frame.
+
+        Returns:
+            tuple: (frame, epoch seconds when it was decoded, frame number),
+                   (None, None, 0) until the first frame arrives
+        """
+        with self.lock:
+            return self.frame, self.frame_time, self.frame_count
+
+class CameraWorker:
+    """
+    Thread sampling one camera: keeps the frames where the scene changed in its
+    ring and, if there is a store, saves them to disk.
+
+    Args:
+        name (str): camera name, e.g. "front"
+        url (str): stream URL for cv2.VideoCapture
+        fps (float): frames sampled per second
+        ring (framebuffer.FrameRing): last frames kept in memory
+        store (frames.FrameStore): where frames are saved, None to not save them
+        on_frame (function): called with (name, metadata, BGR frame) after each frame kept
+        encoder (variants.VariantEncoder): resolutions of the frames kept, may be shared
+                                           by several cameras
+    """
+
+    def __init__(self, name, url, fps, ring, store=None, on_frame=None, encoder=None):
+        self.name = name
+        self.interval = 1 / fps
+        self.ring = ring
+        self.store = store
+        self.encoder = encoder or VariantEncoder()
+        self.on_frame = on_frame
+        # Only the frames where the scene changed are encoded, kept and saved
+        self.change_detector = ChangeDetector()
+        self.sampled_frame_count = 0
+        self.frames_dropped = 0
+        self.frames_saved = 0
+        self.frames_unchanged = 0
+        self.change_score = None
+        self.grabber = FrameGrabber(url, name)
+        # One sample per tick, without drifting after a slow one
+        self.ticker = Ticker(self.interval)
+        # Totals of the previous samples() call, for the rates over the last interval
+        self.last_totals = (time.monotonic(), 0, 0.0)
+        self.thread = threading.Thread(target=self._run, name=f"camera-{name}", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            self.ticker.wait()
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"[{self.name}] ❌ Error processing the frame: {e}", flush=True)
+
+    def sample(self):
+        # Newest frame decoded by the grabber, named after the time it was decoded
+        frame, frame_time, frame_count = self.grabber.latest()
+        if frame is None or frame_count == self.sampled_frame_count:
+            print(f"[{self.name}] [{datetime.now(timezone.utc)}] ❌ No new image from the camera", flush=True)
+            return
+        if self.sampled_frame_count:
+            # Decoded and replaced by newer ones before being sampled
+            self.frames_dropped += frame_count - self.sampled_frame_count - 1
+        self.sampled_frame_count = frame_count
+
+        keep, self.change_score = self.change_detector.check(frame, frame_time)
+        if not keep:
+            self.frames_unchanged += 1
+            return
+
+        # Every resolution encoded once for both the ring and the archive
+        jpegs = self.encoder.encode(frame)
+        self.ring.put(jpegs, frame_time, frame_id=frame_count, change=self.change_score)
+        filepath = None
+        if self.store is not None:
+            # Saving also rotates the oldest frames out
+            filepath = self.store.save(jpegs.get("full") or next(iter(jpegs.values())), frame_time)
+            self.frames_saved += 1
+        if self.on_frame is not None:
+            self.on_frame(self.name, {"frame_id": frame_count, "path": filepath, "time": frame_time,
+                                      "change": round(self.change_score, 4)}, frame)
+        print(f"[{self.name}] [{datetime.fromtimestamp(frame_time, timezone.utc)}] ✅ Frame {frame_count} "
+              f"captured, change {self.change_score:.3f}", flush=True)
+
+    def samples(self):
+        # Metrics for metrics.write_textfile, labelled with the camera name
+        grabber = self.grabber
+        frame, frame_time, frame_count = grabber.latest()
+
+        # Decoding rate and mean read() time since the previous call
+        now, decode_seconds = time.monotonic(), grabber.decode_seconds
+        last_time, last_count, last_decode_seconds = self.last_totals
+        self.last_totals = (now, frame_count, decode_seconds)
+        decoded = frame_count - last_count
+        fps = decoded / (now - last_time) if now > last_time else None
+        read_latency = (decode_seconds - last_decode_seconds) / decoded if decoded else None
+
+        ticks = self.ticker.stats()
+
+        label = f'{{camera="{self.name}"}}'
+        return [
+            # The frame age is computed by the servers from the frame slot (see ingest.py)
+            ("vikare_image_frames_decoded_total" + label, "counter", "Frames decoded from the camera.", frame_count),
+            ("vikare_image_decode_fps" + label, "gauge",
+             "Frames decoded per second since the previous update.", fps),
+            ("vikare_image_read_latency_seconds" + label, "gauge",
+             "Mean seconds of a successful read() from the camera since the previous update.", read_latency),
+            ("vikare_image_frames_dropped_total" + label, "counter",
+             "Frames decoded and replaced by a newer one before being sampled.", self.frames_dropped),
+            ("vikare_image_frames_saved_total" + label, "counter", "Frames saved to disk.", self.frames_saved),
+            ("vikare_image_frames_unchanged_total" + label, "counter",
+             "Frames sampled and dropped because the scene did not change.", self.frames_unchanged),
+            ("vikare_image_frame_change_score" + label, "gauge",
+             "Difference of the last frame sampled with the last one kept, from 0 to 1.", self.change_score),
+            ("vikare_image_tick_jitter_seconds" + label, "gauge",
+             "Mean delay of the sampling ticks since the previous update.", ticks["jitter_mean"]),
+            ("vikare_image_tick_jitter_max_seconds" + label, "gauge",
+             "Maximum delay of a sampling tick since the previous update.", ticks["jitter_max"]),
+            ("vikare_image_ticks_skipped_total" + label, "counter",
+             "Sampling ticks skipped because the previous ones ran late.", ticks["skipped"]),
+            ("vikare_image_stream_errors_total" + label, "counter", "Failed reads from the camera.",
+             grabber.errors),
+            ("vikare_image_stream_reconnects_total" + label, "counter",
+             "Times the stream was reopened after a failed or hung read.", grabber.reconnects),
+            ("vikare_image_stream_hangs_total" + label, "counter",
+             f"Reads or opens taking more than {DECODE_TIMEOUT_SEC}s.", grabber.hangs),
+            ("vikare_image_stream_blocked_readers" + label, "gauge",
+             "Readers given up by the watchdog and still blocked.", len(grabber.abandoned)),
+        ]
@@ -0,0 +1,376 @@
+#!/usr/bin/python
+# JSON lines event log written by sensors.py and read by llm.py
+import bisect
+import collections
+import fcntl
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+# Bytes read on each step while walking the file backwards
+TAIL_BLOCK_SIZE = 4096
+
+def _tail_lines(f, count, block_size=TAIL_BLOCK_SIZE):
+    # Yield complete lines from the end of an open binary file, newest first.
+    # A final line without "\n" is still being written by sensors.py, so it is skipped.
+    f.seek(0, os.SEEK_END)
+    position = f.tell()
+    buffer = b""
+    skip_partial = True
+    found = 0
+
+    while position > 0 and found < count:
+        read_size = min(block_size, position)
+        position -= read_size
+        f.seek(position)
+        buffer = f.read(read_size) + buffer
+
+        if skip_partial:
+            if b"\n" not in buffer:
+                continue
+            # Drop whatever follows the last newline (partial or empty)
+            buffer = buffer[:buffer.rindex(b"\n") + 1]
+            skip_partial = False
+
+        # Every line except the first one in buffer is known to be complete
+        lines = buffer.split(b"\n")
+        buffer = lines[0]
+        for line in reversed(lines[1:]):
+            if line.strip():
+                found += 1
+                yield line
+                if found >= count:
+                    return
+
+    # Reached the beginning of the file: the first line is complete too
+    if position == 0 and not skip_partial and buffer.strip() and found < count:
+        yield buffer
+
+def read_last_events(events_file, count):
+    """
+    Read the last complete events of a JSON lines file without reading it whole.
+
+    Args:
+        events_file (str): path to the event log
+        count (int): maximum number of events to return
+
+    Returns:
+        list: decoded events, oldest first
+    """
+    events = []
+    if count <= 0:
+        return events
+
+    with open(events_file, "rb") as f:
+        for line in _tail_lines(f, count):
+            try:
+                events.append(json.loads(line.decode("utf-8")))
+            except ValueError:
+                # Corrupted line (e.g. crash in the middle of a write), ignore it
+                continue
+
+    events.reverse()
+    return events
+
+def read_last_event(events_file):
+    """
+    Read the last complete event of a JSON lines file seeking from its end.
+
+    Returns:
+        dict: last event or None if the file has no complete events
+    """
+    with open(events_file, "rb") as f:
+        for line in _tail_lines(f, float("inf")):
+            try:
+                return json.loads(line.decode("utf-8"))
+            except ValueError:
+                continue
+
+    return None
+
+## Segmented event log
+# sensors.py appends to the newest segment of EVENTS_DIR and starts a new one when it
+# grows too big or too old. manifest.json lists the segments with their time range so
+# readers can go straight to the segment they need.
+
+MANIFEST_FILE = "manifest.json"
+LOCK_FILE = ".lock"
+
+def _env_float(name, default):
+    return float(os.environ.get(name, default))
+
+def load_manifest(events_dir):
+    """
+    Load the segments manifest of an event log directory.
+
+    Returns:
+        list: segments, oldest first. Each one is a dict with "file", "start", "end"
+              and "size" where "end" is None for the segment being written.
+    """
+    try:
+        with open(os.path.join(events_dir, MANIFEST_FILE), "r") as f:
+            return json.load(f)["segments"]
+    except FileNotFoundError:
+        return []
+
+def _save_manifest(events_dir, segments):
+    # Write to a temporary file and rename so readers never see half a manifest
+    manifest_path = os.path.join(events_dir, MANIFEST_FILE)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"segments": segments}, f)
+    os.replace(tmp_path, manifest_path)
+
+def find_segment(events_dir, timestamp, segments=None):
+    """
+    Find the segment covering a timestamp.
+
+    Args:
+        events_dir (str): event log directory
+        timestamp (float): epoch seconds
+        segments (list): manifest already loaded, if any
+
+    Returns:
+        str: path of the segment or None if the timestamp is older than the retention
+    """
+    if segments is None:
+        segments = load_manifest(events_dir)
+
+    # Segments are sorted by start time
+    index = bisect.bisect_right([segment["start"] for segment in segments], timestamp) - 1
+    if index < 0:
+        return None
+    return os.path.join(events_dir, segments[index]["file"])
+
+def latest_events(events_dir, count):
+    """
+    Read the last complete events of a segmented log, oldest first.
+
+    Walks the segments from the newest one backwards only as far as needed.
+    """
+    events = []
+    for segment in reversed(load_manifest(events_dir)):
+        try:
+            events = read_last_events(os.path.join(events_dir, segment["file"]), count - len(events)) + events
+        except FileNotFoundError:
+            # Removed by retention while we were reading
+            continue
+        if len(events) >= count:
+            break
+    return events
+
+def latest_event(events_dir):
+    events = latest_events(events_dir, 1)
+    return events[-1] if events else None
+
+class SegmentedEventLog:
+    """
+    Append only event log split in segments with retention.
+
+    Keeps the current segment open so a write is a single append. Several
+    processes (server workers) can write to the same directory: every write
+    takes a lock file and picks up rotations done by the other writers.
+
+    Args:
+        events_dir (str): directory for segments and manifest
+        max_segment_bytes (int): start a new segment when the current one is bigger
+        max_segment_age (float): start a new segment after these seconds
+        retention_age (float): remove segments that ended more than these seconds ago
+        retention_bytes (int): remove oldest segments while the log is bigger than this
+    """
+
+    def __init__(self, events_dir,
+                 max_segment_bytes=int(_env_float("EVENTS_SEGMENT_MAX_BYTES", 16 * 1024 * 1024)),
+                 max_segment_age=_env_float("EVENTS_SEGMENT_MAX_AGE_SEC", 3600),
+                 retention_age=_env_float("EVENTS_RETENTION_SEC", 7 * 24 * 3600),
+                 retention_bytes=int(_env_float("EVENTS_RETENTION_BYTES", 512 * 1024 * 1024))):
+        self.events_dir = events_dir
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age = max_segment_age
+        self.retention_age = retention_age
+        self.retention_bytes = retention_bytes
+        self.file = None
+        self.file_name = None
+        self.segments = []
+        self.manifest_mtime = None
+
+        os.makedirs(events_dir, exist_ok=True)
+        self.lock_file = open(os.path.join(events_dir, LOCK_FILE), "a")
+
+    def _open(self, segment):
+        if self.file is not None:
+            self.file.close()
+        self.file = open(os.path.join(self.events_dir, segment["file"]), "ab")
+        self.file_name = segment["file"]
+
+    def _refresh(self):
+        # Reload the manifest if another writer (or a previous run) changed it
+        try:
+            mtime = os.stat(os.path.join(self.events_dir, MANIFEST_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime != self.manifest_mtime:
+            self.segments = load_manifest(self.events_dir)
+            self.manifest_mtime = mtime
+
+        current = self.segments[-1] if self.segments else None
+        if current is not None and current["end"] is None and current["file"] != self.file_name:
+            self._open(current)
+
+    def _save(self):
+        _save_manifest(self.events_dir, self.segments)
+        self.manifest_mtime = os.stat(os.path.join(self.events_dir, MANIFEST_FILE)).st_mtime_ns
+
+    def _rotate(self, now):
+        if self.segments:
+            self.segments[-1]["end"] = now
+
+        segment = {"file": "%d.log" % int(now * 1000), "start": now, "end": None, "size": 0}
+        self.segments.append(segment)
+        self._open(segment)
+        self._apply_retention(now)
+        self._save()
+
+    def _apply_retention(self, now):
+        total_bytes = sum(segment["size"] for segment in self.segments)
+        # Never remove the segment being written
+        while len(self.segments) > 1:
+            oldest = self.segments[0]
+            if now - oldest["end"] <= self.retention_age and total_bytes <= self.retention_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.events_dir, oldest["file"]))
+            except FileNotFoundError:
+                pass
+            total_bytes -= oldest["size"]
+            self.segments.pop(0)
+
+    def write(self, data, now=None):
+        """
+        Append one chunk of complete JSON lines.
+
+        Args:
+            data (bytes): one or more lines, each ending with "\\n"
+            now (float): epoch seconds, defaults to time.time()
+        """
+        if now is None:
+            now = time.time()
+
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        try:
+            self._refresh()
+            current = self.segments[-1] if self.segments else None
+            if current is not None:
+                # Other writers may have appended to it too
+                current["size"] = os.fstat(self.file.fileno()).st_size
+            if (current is None
+                    or current["size"] >= self.max_segment_bytes
+                    or now - current["start"] >= self.max_segment_age):
+                self._rotate(now)
+
+            self.file.write(data)
+            self.file.flush()
+        finally:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def sync(self):
+        # Make the written data durable on the PVC
+        if self.file is not None:
+            os.fsync(self.file.fileno())
+
+    def append(self, event, now=None):
+        self.write((json.dumps(event) + "\n").encode("utf-8"), now)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.lock_file.close()
+
+## Group commit
+# Requests only encode their events and queue them. A single thread writes everything
+# queued during COMMIT_INTERVAL_SEC with one write and one fsync.
+
+# "enqueue": answer as soon as the events are queued
+# "fsync": answer when the events are on disk
+DURABILITY = os.environ.get("EVENTS_DURABILITY", "enqueue")
+COMMIT_INTERVAL_SEC = _env_float("EVENTS_COMMIT_INTERVAL_SEC", 0.05)
+
+class GroupCommitWriter:
+    """
+    Coalesce events from all requests into one write and fsync per interval.
+
+    Args:
+        log (SegmentedEventLog): log where batches are written
+        interval (float): seconds between commits
+        durability (str): "enqueue" or "fsync", see DURABILITY
+        on_commit (callable): called with the seconds and bytes of every commit
+    """
+
+    def __init__(self, log, interval=COMMIT_INTERVAL_SEC, durability=DURABILITY, on_commit=None):
+        if durability not in ("enqueue", "fsync"):
+            raise ValueError("durability must be 'enqueue' or 'fsync', not %r" % durability)
+
+        self.log = log
+        self.interval = interval
+        self.durability = durability
+        self.on_commit = on_commit
+        # deque append/popleft are thread safe, no lock needed
+        self.pending = collections.deque()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="event-log-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, events):
+        """
+        Queue events to be written in the next commit.
+
+        Returns:
+            Future: resolved with the number of bytes written when the commit is
+                    fsynced, or with the exception if it failed
+        """
+        data = "".join(json.dumps(event) + "\n" for event in events).encode("utf-8")
+        future = Future()
+        self.pending.append((data, future))
+        return future
+
+    def commit(self, events, timeout=None):
+        # Queue events and wait for the fsync if the durability requires it
+        future = self.submit(events)
+        if self.durability == "fsync":
+            future.result(timeout)
+        return future
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        batch = []
+        while self.pending:
+            batch.append(self.pending.popleft())
+        if not batch:
+            return
+
+        data = b"".join(chunk for chunk, future in batch)
+        start = time.perf_counter()
+        try:
+            self.log.write(data)
+            self.log.sync()
+        except Exception as e:
+            print(f"Error writing events: {e}", flush=True)
+            for chunk, future in batch:
+                future.set_exception(e)
+        else:
+            if self.on_commit is not None:
+                self.on_commit(time.perf_counter() - start, len(data))
+            for chunk, future in batch:
+                future.set_result(len(chunk))
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.flush()
+        self.log.close()
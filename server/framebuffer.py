@@ -0,0 +1,233 @@
+#!/usr/bin/python
+# Last frames kept in memory by image.py and served to llm.py over a unix socket in
+# STATE_DIR (see state.py), so the LLM gets the JPEG bytes without going through the
+# PVC. Saving the frames to disk (frames.py) is only an archive.
+#
+# There is one ring per camera, and each frame has its JPEG at several resolutions
+# (see variants.py). Protocol, one request per line and one response per request,
+# "camera" and "variant" are optional and default to the first ones:
+#   request   {"op": "latest", "camera": <name>, "variant": <name>}
+#             or {"op": "nearest", "camera": <name>, "variant": <name>,
+#                 "time": <epoch seconds>, "tolerance_ms": <ms>}
+#   response  JSON line with the frame metadata ({} if there is none) followed by
+#             metadata["size"] bytes of JPEG, only the metadata if the request has
+#             "head": true
+# When image.py builds a mosaic (see mosaic.py) it is served as the camera "mosaic".
+#   request   {"op": "cameras"}
+#   response  JSON line {"cameras": [<name>, ...]}
+import bisect
+import collections
+import json
+import os
+import socket
+import socketserver
+import threading
+from state import STATE_DIR
+
+FRAMES_SOCKET = os.path.join(STATE_DIR, "frames.sock")
+FRAME_BUFFER_SIZE = int(os.environ.get("FRAME_BUFFER_SIZE", 30))
+CLIENT_TIMEOUT_SEC = 5
+
+class FrameRing:
+    """
+    Last frames as encoded by image.py, oldest first.
+
+    Args:
+        capacity (int): frames kept, the oldest are dropped
+    """
+
+    def __init__(self, capacity=FRAME_BUFFER_SIZE):
+        self.lock = threading.Lock()
+        # (epoch seconds, metadata, {variant: JPEG bytes})
+        self.frames = collections.deque(maxlen=capacity)
+
+    def put(self, jpegs, timestamp, **metadata):
+        """
+        Add a frame.
+
+        Args:
+            jpegs (dict): variant name -> encoded frame, the first one is the default
+            timestamp (float): epoch seconds when it was decoded
+            metadata: JSON serializable values returned with the frame, e.g. frame_id
+        """
+        metadata = dict(metadata, time=timestamp)
+        with self.lock:
+            self.frames.append((timestamp, metadata, jpegs))
+
+    def _variant(self, frame, variant):
+        # (metadata, JPEG) of a variant of a frame, the default one if it does not have it
+        _, metadata, jpegs = frame
+        if variant not in jpegs:
+            variant = next(iter(jpegs))
+        jpeg = jpegs[variant]
+        return dict(metadata, variant=variant, size=len(jpeg)), jpeg
+
+    def latest(self, variant=None):
+        # (metadata, JPEG) of the newest frame, (None, None) if there are none
+        with self.lock:
+            if not self.frames:
+                return None, None
+            return self._variant(self.frames[-1], variant)
+
+    def nearest(self, timestamp, tolerance_ms=None, variant=None):
+        # (metadata, JPEG) of the frame closest to timestamp, (None, None) if there is
+        # none within tolerance_ms. Of several frames with the same time, the newest.
+        with self.lock:
+            times = [frame[0] for frame in self.frames]
+            index = bisect.bisect_right(times, timestamp)
+            candidates = [i for i in (index - 1, index) if 0 <= i < len(times)]
+            if not candidates:
+                return None, None
+            best = min(candidates, key=lambda i: abs(times[i] - timestamp))
+            best = bisect.bisect_right(times, times[best]) - 1
+            if tolerance_ms is not None and abs(times[best] - timestamp) * 1000 > tolerance_ms:
+                return None, None
+            return self._variant(self.frames[best], variant)
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        rings = self.server.rings
+        # Clients keep the connection open for several requests
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if request.get("op") == "cameras":
+                    self.wfile.write(json.dumps({"cameras": list(rings)}).encode() + b"\n")
+                    self.wfile.flush()
+                    continue
+                camera = request.get("camera")
+                ring = rings.get(camera) if camera is not None else next(iter(rings.values()))
+                if ring is None:
+                    metadata, jpeg = None, None
+                elif request.get("op") == "nearest":
+                    metadata, jpeg = ring.nearest(request["time"], request.get("tolerance_ms"),
+                                                  request.get("variant"))
+                else:
+                    metadata, jpeg = ring.latest(request.get("variant"))
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"Bad frame request {line!r}: {e}", flush=True)
+                return
+            self.wfile.write(json.dumps(metadata or {}).encode() + b"\n")
+            if jpeg is not None and not request.get("head"):
+                self.wfile.write(jpeg)
+            self.wfile.flush()
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class FrameServer:
+    """
+    Thread serving the FrameRing of every camera on a unix socket.
+
+    Args:
+        rings (dict): camera name -> FrameRing, the first one is the default camera
+        path (str): socket path
+    """
+
+    def __init__(self, rings, path=FRAMES_SOCKET):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            # Left by a previous run
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        self.server = _Server(path, _Handler)
+        self.server.rings = rings
+        os.chmod(path, 0o666)
+        self.thread = threading.Thread(target=self.server.serve_forever, name="frame-server", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class FrameClient:
+    """
+    Frames of a FrameServer, e.g. in llm.py.
+
+    Args:
+        path (str): socket path
+    """
+
+    def __init__(self, path=FRAMES_SOCKET):
+        self.path = path
+        self.sock = None
+        self.rfile = None
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(CLIENT_TIMEOUT_SEC)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+        self.rfile = sock.makefile("rb")
+
+    def _request(self, request, frame=True):
+        # One retry with a new connection, e.g. image.py restarted
+        for attempt in (0, 1):
+            try:
+                if self.sock is None:
+                    self._connect()
+                self.sock.sendall(json.dumps(request).encode() + b"\n")
+                header = self.rfile.readline()
+                if not header:
+                    raise ConnectionError("frame server closed the connection")
+                metadata = json.loads(header)
+                if not frame:
+                    return metadata
+                if not metadata:
+                    return None, None
+                if request.get("head"):
+                    return metadata, None
+                jpeg = self.rfile.read(metadata["size"])
+                if len(jpeg) != metadata["size"]:
+                    raise ConnectionError("frame truncated")
+                return metadata, jpeg
+            except OSError:
+                self.close()
+                if attempt:
+                    raise
+
+    def cameras(self):
+        # Names of the cameras, the default one first
+        return self._request({"op": "cameras"}, frame=False)["cameras"]
+
+    def latest(self, camera=None, variant=None, head=False):
+        """
+        Newest frame of a camera.
+
+        Args:
+            camera (str): camera name, None for the default one
+            variant (str): resolution (see variants.py), None for the default one
+            head (bool): only the metadata, the JPEG is None
+
+        Returns:
+            tuple: (metadata, JPEG bytes), (None, None) if there are no frames
+        """
+        return self._request({"op": "latest", "camera": camera, "variant": variant, "head": head})
+
+    def nearest(self, timestamp, tolerance_ms=None, camera=None, variant=None):
+        """
+        Frame of a camera closest to a time.
+
+        Args:
+            timestamp (float): epoch seconds
+            tolerance_ms (int): maximum distance in milliseconds, None for any
+            camera (str): camera name, None for the default one
+            variant (str): resolution (see variants.py), None for the default one
+
+        Returns:
+            tuple: (metadata, JPEG bytes), (None, None) if there is none
+        """
+        return self._request({"op": "nearest", "time": timestamp, "tolerance_ms": tolerance_ms,
+                              "camera": camera, "variant": variant})
+
+    def close(self):
+        if self.sock is not None:
+            self.rfile.close()
+            self.sock.close()
+        self.sock = None
+        self.rfile = None
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# Change detection between camera frames, so image.py only encodes and saves the
+# frames where something moved.
+#
+# Frames are compared as small grayscale thumbnails: the score is the mean absolute
+# difference of their pixels, from 0 (identical) to 1 (black to white). Each frame
+# is compared to the last one kept, not to the previous one, so slow changes add up
+# until they are kept too.
+import os
+import cv2
+import numpy as np
+
+# Width and height of the thumbnails compared
+CHANGE_THUMBNAIL_SIZE = (64, 48)
+# Minimum score of a frame to be kept
+CHANGE_THRESHOLD = float(os.environ.get("CHANGE_THRESHOLD", 0.02))
+# Keep a frame at least this often even if nothing changed, 0 to only keep changes
+CHANGE_MAX_INTERVAL_SEC = float(os.environ.get("CHANGE_MAX_INTERVAL_SEC", 60))
+
+def thumbnail(frame, size=CHANGE_THUMBNAIL_SIZE):
+    # Grayscale thumbnail of a BGR frame as int16, ready to subtract
+    small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    return small.astype(np.int16)
+
+class ChangeDetector:
+    """
+    Decides which frames are different enough from the last one kept.
+
+    Args:
+        threshold (float): minimum score to keep a frame
+        max_interval (float): seconds after which a frame is kept anyway, 0 never
+    """
+
+    def __init__(self, threshold=CHANGE_THRESHOLD, max_interval=CHANGE_MAX_INTERVAL_SEC):
+        self.threshold = threshold
+        self.max_interval = max_interval
+        self.reference = None
+        self.reference_time = None
+
+    def score(self, frame):
+        """
+        Difference of a frame with the last one kept.
+
+        Returns:
+            tuple: (score from 0 to 1, thumbnail of the frame); the score is 1 for
+                   the first frame
+        """
+        small = thumbnail(frame)
+        if self.reference is None or self.reference.shape != small.shape:
+            return 1.0, small
+        return float(np.abs(small - self.reference).mean()) / 255, small
+
+    def check(self, frame, timestamp):
+        """
+        Score a frame and keep it as the new reference if it changed enough.
+
+        Args:
+            frame (numpy.ndarray): BGR frame
+            timestamp (float): epoch seconds when it was decoded
+
+        Returns:
+            tuple: (keep the frame, score)
+        """
+        score, small = self.score(frame)
+        keep = (score >= self.threshold
+                or (self.max_interval and timestamp - self.reference_time >= self.max_interval))
+        if keep:
+            self.reference = small
+            self.reference_time = timestamp
+        return bool(keep), score
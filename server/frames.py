@@ -0,0 +1,230 @@
+#!/usr/bin/python
+# Frames saved by image.py on the PVC
+#
+# Besides the frames, the directory has a manifest so other processes (llm.py) find
+# the frame of a given time without listing it. It is append only:
+#   +<epoch ms> <file name>   frame saved
+#   -<epoch ms>               frame removed
+# image.py rewrites it with only the frames kept when it starts and when the removed
+# entries dominate, always with an atomic rename so readers notice the new file by
+# its inode and load it again from the beginning.
+import bisect
+import collections
+import os
+from datetime import datetime, timezone
+
+# Frames are named after the UTC time they were decoded, e.g. 2025-01-01-12-00-00-250.jpg
+FILENAME_FORMAT = "%Y-%m-%d-%H-%M-%S-%f"
+MANIFEST_FILE = "frames.manifest"
+# Rewrite the manifest when it has this many entries per frame kept
+MANIFEST_COMPACT_RATIO = 4
+
+def frame_filename(timestamp):
+    # File name for a frame decoded at timestamp (epoch seconds)
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime(FILENAME_FORMAT)[:-3] + ".jpg"
+
+def frame_timestamp(filename):
+    # Epoch seconds of a frame from its file name
+    return datetime.strptime(filename[:-4], FILENAME_FORMAT).replace(tzinfo=timezone.utc).timestamp()
+
+def _ms(timestamp):
+    return int(round(timestamp * 1000))
+
+class FrameStore:
+    """
+    Saved frames in time order with retention by count, bytes and age.
+
+    The directory is listed only once, when it is created. After that every
+    frame is appended to an in memory index and the oldest are evicted from its
+    head, so rotation does not depend on how many frames are kept.
+
+    Args:
+        directory (str): where the frames are saved
+        max_count (int): frames kept, 0 for no limit
+        max_bytes (int): total size kept, 0 for no limit
+        max_age (float): seconds a frame is kept, 0 for no limit
+    """
+
+    def __init__(self, directory, max_count=0, max_bytes=0, max_age=0):
+        self.directory = directory
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # (timestamp, file name, size), oldest first
+        self.frames = collections.deque()
+        self.total_bytes = 0
+
+        os.makedirs(directory, exist_ok=True)
+        for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+            if not entry.name.endswith(".jpg"):
+                continue
+            try:
+                timestamp = frame_timestamp(entry.name)
+            except ValueError:
+                # Not written by us
+                continue
+            size = entry.stat().st_size
+            self.frames.append((timestamp, entry.name, size))
+            self.total_bytes += size
+
+        self.manifest_path = os.path.join(directory, MANIFEST_FILE)
+        self.manifest = None
+        self._compact_manifest()
+
+    def _compact_manifest(self):
+        # Manifest with only the frames kept, replaced atomically
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.writelines(f"+{_ms(timestamp)} {filename}\n" for timestamp, filename, _ in self.frames)
+        os.replace(tmp_path, self.manifest_path)
+        if self.manifest is not None:
+            self.manifest.close()
+        self.manifest = open(self.manifest_path, "a")
+        self.manifest_entries = len(self.frames)
+
+    def _log(self, line):
+        # One write per entry so readers never see half of it
+        self.manifest.write(line)
+        self.manifest.flush()
+        self.manifest_entries += 1
+
+    def save(self, data, timestamp):
+        """
+        Write an encoded frame and apply the retention.
+
+        Args:
+            data (bytes): JPEG
+            timestamp (float): epoch seconds when the frame was decoded
+
+        Returns:
+            str: path of the saved frame
+        """
+        filename = frame_filename(timestamp)
+        path = os.path.join(self.directory, filename)
+        with open(path, "wb") as f:
+            f.write(data)
+
+        self.frames.append((timestamp, filename, len(data)))
+        self.total_bytes += len(data)
+        self._log(f"+{_ms(timestamp)} {filename}\n")
+        self.evict(timestamp)
+        if self.manifest_entries > MANIFEST_COMPACT_RATIO * max(len(self.frames), 1):
+            self._compact_manifest()
+        return path
+
+    def evict(self, now):
+        # Remove the oldest frames while any limit is exceeded, never the newest one
+        while len(self.frames) > 1:
+            timestamp, filename, size = self.frames[0]
+            if not ((self.max_count and len(self.frames) > self.max_count)
+                    or (self.max_bytes and self.total_bytes > self.max_bytes)
+                    or (self.max_age and now - timestamp > self.max_age)):
+                break
+            self.frames.popleft()
+            self.total_bytes -= size
+            self._log(f"-{_ms(timestamp)}\n")
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except FileNotFoundError:
+                pass
+
+    def __len__(self):
+        return len(self.frames)
+
+class FrameIndex:
+    """
+    Saved frames by time, read from the manifest written by FrameStore.
+
+    Each call to nearest() reads only the entries appended since the previous
+    one, and finds the frame with a binary search on the sorted times.
+
+    Args:
+        directory (str): where image.py saves the frames
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, MANIFEST_FILE)
+        # Epoch ms and file names sorted by time, valid from self.start on
+        self.times = []
+        self.names = []
+        self.start = 0
+        self.inode = None
+        self.offset = 0
+
+    def refresh(self):
+        # Apply the entries appended to the manifest since the last call
+        try:
+            f = open(self.manifest_path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            inode = os.fstat(f.fileno()).st_ino
+            if inode != self.inode:
+                # First read or compacted by image.py
+                self.times, self.names, self.start = [], [], 0
+                self.inode, self.offset = inode, 0
+            f.seek(self.offset)
+            data = f.read()
+
+        # Only complete lines, the rest is read on the next call
+        end = data.rfind(b"\n") + 1
+        self.offset += end
+        for line in data[:end].decode().splitlines():
+            if line.startswith("+"):
+                ms, name = line[1:].split(" ", 1)
+                self._add(int(ms), name)
+            elif line.startswith("-"):
+                self._remove(int(line[1:]))
+
+        # Drop the removed head once it is half of the list
+        if self.start > len(self.times) // 2:
+            del self.times[:self.start]
+            del self.names[:self.start]
+            self.start = 0
+
+    def _add(self, ms, name):
+        if not self.times or ms >= self.times[-1]:
+            self.times.append(ms)
+            self.names.append(name)
+        else:
+            index = bisect.bisect_right(self.times, ms, self.start)
+            self.times.insert(index, ms)
+            self.names.insert(index, name)
+
+    def _remove(self, ms):
+        # Frames are removed oldest first
+        if self.start < len(self.times) and self.times[self.start] == ms:
+            self.start += 1
+            return
+        index = bisect.bisect_left(self.times, ms, self.start)
+        if index < len(self.times) and self.times[index] == ms:
+            del self.times[index]
+            del self.names[index]
+
+    def __len__(self):
+        return len(self.times) - self.start
+
+    def nearest(self, timestamp, tolerance_ms=None):
+        """
+        Frame closest in time.
+
+        Args:
+            timestamp (float): epoch seconds
+            tolerance_ms (int): maximum distance in milliseconds, None for any
+
+        Returns:
+            str: path of the frame or None if there is none close enough
+        """
+        self.refresh()
+        if not len(self):
+            return None
+
+        target = _ms(timestamp)
+        index = bisect.bisect_left(self.times, target, self.start)
+        # Closest of the frames before and after target
+        candidates = [i for i in (index - 1, index) if self.start <= i < len(self.times)]
+        best = min(candidates, key=lambda i: abs(self.times[i] - target))
+        if tolerance_ms is not None and abs(self.times[best] - target) > tolerance_ms:
+            return None
+        return os.path.join(self.directory, self.names[best])
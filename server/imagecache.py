@@ -0,0 +1,64 @@
+#!/usr/bin/python
+# Images ready to send to the model: base64 of the JPEG, as the ollama API expects
+# them. A frame used by several decisions or retries is fetched and encoded once.
+import base64
+import collections
+import os
+import threading
+
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get("IMAGE_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+
+class ImagePayloadCache:
+    """
+    Least recently used base64 payloads, bounded by their total size.
+
+    Args:
+        max_bytes (int): total size of the payloads kept
+    """
+
+    def __init__(self, max_bytes=IMAGE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # key -> base64 str, least recently used first
+        self.payloads = collections.OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, load):
+        """
+        Payload of an image, loaded and encoded only if it is not cached.
+
+        Args:
+            key (tuple): identifies the image, e.g. (camera, frame id, time, variant)
+            load (function): returns the JPEG bytes, or None if there is no image
+
+        Returns:
+            str: base64 of the JPEG, None if load() returned None
+        """
+        with self.lock:
+            payload = self.payloads.get(key)
+            if payload is not None:
+                self.payloads.move_to_end(key)
+                self.hits += 1
+                return payload
+            self.misses += 1
+
+        jpeg = load()
+        if jpeg is None:
+            return None
+        payload = base64.b64encode(jpeg).decode()
+
+        with self.lock:
+            if key not in self.payloads:
+                self.payloads[key] = payload
+                self.total_bytes += len(payload)
+            while self.total_bytes > self.max_bytes and len(self.payloads) > 1:
+                _, evicted = self.payloads.popitem(last=False)
+                self.total_bytes -= len(evicted)
+        return payload
+
+    def hit_rate(self):
+        # Fraction of get() calls served from the cache, None before the first one
+        total = self.hits + self.misses
+        return self.hits / total if total else None
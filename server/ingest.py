@@ -0,0 +1,176 @@
+#!/usr/bin/python
+# Request handling shared by the development server (sensors.py) and the
+# production server (sensors_asgi.py), and the paths on the PVC of all the containers
+import json
+import os
+import threading
+import time
+import wire
+from metrics import Registry
+from state import SharedState
+
+DATA_DIR = os.environ.get("VIKARE_DATA_DIR", "/usr/local/src/data")
+
+# Segments of the event log and their manifest (see eventlog.py)
+EVENTS_DIR = os.path.join(DATA_DIR, "events")
+
+# Snapshot of the sensors history (see timeseries.py)
+HISTORY_SNAPSHOT_FILE = os.path.join(DATA_DIR, "history.npz")
+
+# Queue of plans published by llm.py (see instructions.py)
+INSTRUCTIONS_DIR = os.path.join(DATA_DIR, "instructions")
+
+# Frames saved by image.py, one directory per camera (see frames.py)
+IMAGES_DIR = os.path.join(DATA_DIR, "images")
+
+# Robots labelled in the metrics, comma separated. Empty accepts the first
+# MAX_ROBOT_LABELS ids each worker sees (see robot_id)
+ROBOT_IDS = [robot for robot in os.environ.get("ROBOT_IDS", "").split(",") if robot]
+MAX_ROBOT_LABELS = int(os.environ.get("MAX_ROBOT_LABELS", 8))
+MAX_ROBOT_ID_LENGTH = 64
+_robot_labels = set(ROBOT_IDS)
+_robot_labels_lock = threading.Lock()
+
+# Longest time a GET /instructions?wait= request is held
+MAX_INSTRUCTIONS_WAIT_SEC = 60
+# Comment sent on /instructions/stream when there is nothing to push, keeps proxies happy
+STREAM_KEEPALIVE_SEC = 15
+
+def is_binary(content_type):
+    # Binary records from the robot (see wire.py)
+    return bool(content_type) and content_type.startswith(wire.CONTENT_TYPE)
+
+def parse_readings(body, content_type):
+    # Concatenated binary records, JSON array (or a single object) when sent as
+    # application/json, otherwise NDJSON. Raises ValueError unless it is a non empty
+    # list of objects.
+    if is_binary(content_type):
+        readings = wire.decode(body)
+    elif content_type and content_type.startswith("application/json"):
+        readings = json.loads(body)
+        if isinstance(readings, dict):
+            readings = [readings]
+    else:
+        readings = [json.loads(line) for line in body.splitlines() if line.strip()]
+
+    if not isinstance(readings, list) or not all(isinstance(r, dict) for r in readings):
+        raise ValueError("expected a list of readings")
+    if not readings:
+        raise ValueError("no readings")
+    return readings
+
+def publish_readings(shared_state, history, readings):
+    # Latest reading (see state.py) and sensors history (see timeseries.py) for llm.py.
+    # The event log stays the source of truth.
+    try:
+        shared_state.write("sensors", readings[-1])
+        history.append(readings)
+    except (ValueError, TypeError, OSError) as e:
+        print(f"Error publishing sensors state: {e}", flush=True)
+
+def wait_seconds(value):
+    # ?wait= parameter of GET /instructions
+    try:
+        return max(0.0, min(float(value or 0), MAX_INSTRUCTIONS_WAIT_SEC))
+    except ValueError:
+        return 0.0
+
+class InstructionsWatcher:
+    """
+    Thread calling back when llm.py publishes instructions.
+
+    One per server process, long polls and streams wait on the callback
+    instead of each one checking the queue.
+
+    Args:
+        callback (callable): called without arguments from the watcher thread
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        # One FIFO per process, workers do not steal notifications from each other
+        self.shared_state = SharedState(subscriber=f"sensors-{os.getpid()}")
+        self.thread = threading.Thread(target=self._run, name="instructions-watcher", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        sequence = self.shared_state.sequence(["instructions"])
+        while True:
+            sequence = self.shared_state.wait(sequence, slots=["instructions"])
+            self.callback()
+
+class ServerMetrics:
+    """
+    Metrics served on /metrics by both servers.
+
+    Args:
+        instruction_queue (InstructionQueue): queue whose depth and age are reported
+        shared_state (SharedState): to report the age of the last sensors reading and frames
+    """
+
+    def __init__(self, instruction_queue, shared_state):
+        self.registry = registry = Registry()
+        self.request_seconds = registry.histogram(
+            "vikare_request_duration_seconds", "Request latency per route.", ["route"])
+        self.requests = registry.counter(
+            "vikare_requests_total", "Requests per route and robot.", ["route", "robot"])
+        self.commit_seconds = registry.histogram(
+            "vikare_event_log_write_seconds", "Write and fsync time of each event log commit.")
+        self.written_bytes = registry.counter(
+            "vikare_event_log_written_bytes_total", "Bytes written to the event log.")
+
+        def last_event_age():
+            _, timestamp = shared_state.read("sensors")
+            return None if timestamp is None else time.time() - timestamp
+
+        registry.gauge("vikare_last_sensor_event_age_seconds",
+                       "Seconds since the last sensors reading was received.", last_event_age)
+
+        def frame_ages():
+            # From the slot and not from image.py, so it keeps growing if image.py dies
+            frames, _ = shared_state.read("frame")
+            now = time.time()
+            return {(camera,): now - frame["time"]
+                    for camera, frame in ((frames or {}).get("cameras") or {}).items() if frame.get("time")}
+
+        registry.gauge("vikare_image_frame_age_seconds",
+                       "Seconds since the newest frame kept from the camera was decoded, up to "
+                       "CHANGE_MAX_INTERVAL_SEC when the scene does not change.", frame_ages, ["camera"])
+        registry.gauge("vikare_instruction_queue_depth",
+                       "Plans waiting to be delivered to the robot.", instruction_queue.depth)
+        registry.gauge("vikare_instruction_queue_oldest_age_seconds",
+                       "Seconds the oldest pending plan has been waiting.", instruction_queue.oldest_age)
+
+    def observe_request(self, route, robot, seconds):
+        self.request_seconds.observe(seconds, (route,))
+        self.requests.inc((route, robot))
+
+    def observe_commit(self, seconds, size):
+        # on_commit callback of the GroupCommitWriter
+        self.commit_seconds.observe(seconds)
+        self.written_bytes.inc(value=size)
+
+    def render(self):
+        return self.registry.render()
+
+def robot_id(headers):
+    """
+    Robot label of a request, from the X-Robot-Id header sent by esp32/main.py.
+
+    Any client can send any value, so only ROBOT_IDS, or without it the first
+    MAX_ROBOT_LABELS ids seen by the worker, get a label of their own and the rest
+    are counted as "other". The client address is not used: behind the ingress it
+    is always the ingress pod.
+    """
+    value = headers.get("X-Robot-Id")
+    if not value:
+        return "unknown"
+    if value in _robot_labels:
+        return value
+    if ROBOT_IDS or len(value) > MAX_ROBOT_ID_LENGTH:
+        return "other"
+    with _robot_labels_lock:
+        if len(_robot_labels) < MAX_ROBOT_LABELS:
+            _robot_labels.add(value)
+            return value
+    return "other"
@@ -0,0 +1,162 @@
+#!/usr/bin/python
+# Ordered queue of plans published by llm.py and delivered to the robot by the servers.
+#
+# Every plan is a JSON file named by its plan id, so the order is the file order:
+#   pending/<plan_id>.json    written to a temporary file and renamed, readers never see
+#                             half a plan
+#   delivered/<plan_id>.json  moved here with a rename when a request takes it, so only
+#                             one request (or worker) delivers each plan
+# The robot acknowledges the plan id once executed and the file is removed.
+#
+# Plans belong to a decision of llm.py, identified by the plan id of its first plan. A
+# new decision replaces the plans of older ones still pending, so the robot always runs
+# the newest decision and never a backlog of stale ones.
+import fcntl
+import json
+import os
+import time
+
+PLAN_ID_FILE = "next_plan_id"
+# Pending plans of a decision, further steps are refused while the robot does not collect them
+MAX_PENDING = int(os.environ.get("INSTRUCTIONS_MAX_PENDING", 16))
+# Delivered plans never acknowledged are removed after this many seconds
+DELIVERED_RETENTION_SEC = float(os.environ.get("INSTRUCTIONS_DELIVERED_RETENTION_SEC", 3600))
+
+def _plan_file(plan_id):
+    return "%012d.json" % plan_id
+
+def _plan_ids(directory):
+    return sorted(int(name[:-5]) for name in os.listdir(directory) if name.endswith(".json"))
+
+class InstructionQueue:
+    """
+    Plans with monotonically increasing ids, published and consumed atomically.
+
+    Args:
+        queue_dir (str): directory of the queue, shared by llm.py and the servers
+    """
+
+    def __init__(self, queue_dir):
+        self.queue_dir = queue_dir
+        self.pending_dir = os.path.join(queue_dir, "pending")
+        self.delivered_dir = os.path.join(queue_dir, "delivered")
+        os.makedirs(self.pending_dir, exist_ok=True)
+        os.makedirs(self.delivered_dir, exist_ok=True)
+
+    def _next_plan_id(self):
+        with open(os.path.join(self.queue_dir, PLAN_ID_FILE), "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            content = f.read().strip()
+            plan_id = int(content) + 1 if content else 1
+            f.seek(0)
+            f.truncate()
+            f.write(str(plan_id))
+            f.flush()
+            os.fsync(f.fileno())
+        return plan_id
+
+    def publish(self, plan, decision_id=None):
+        """
+        Append a plan to the queue, removing the pending plans of older decisions.
+
+        Args:
+            plan (dict): plan for the robot, e.g. {"steps": [...]}
+            decision_id (int): decision the plan continues, None for a new decision
+
+        Returns:
+            int: plan id, also the decision id of a new decision. None if the decision
+                 already has MAX_PENDING plans pending.
+        """
+        if decision_id is not None:
+            pending = sum(1 for _, plan_decision_id in self._pending_decisions()
+                          if plan_decision_id == decision_id)
+            if pending >= MAX_PENDING:
+                return None
+
+        plan_id = self._next_plan_id()
+        if decision_id is None:
+            decision_id = plan_id
+        plan = dict(plan, plan_id=plan_id, decision_id=decision_id, created=time.time())
+
+        path = os.path.join(self.pending_dir, _plan_file(plan_id))
+        tmp_path = os.path.join(self.queue_dir, _plan_file(plan_id) + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(plan, f)
+        # Before the plan becomes visible, so consume() never hands out an older decision after it
+        self._supersede(decision_id)
+        os.replace(tmp_path, path)
+        self._prune()
+        return plan_id
+
+    def _pending_decisions(self):
+        # (plan id, decision id) of the pending plans, oldest first
+        plans = []
+        for plan_id in _plan_ids(self.pending_dir):
+            try:
+                with open(os.path.join(self.pending_dir, _plan_file(plan_id))) as f:
+                    plans.append((plan_id, json.load(f).get("decision_id", plan_id)))
+            except FileNotFoundError:
+                # Delivered meanwhile
+                continue
+        return plans
+
+    def _supersede(self, decision_id):
+        for plan_id, plan_decision_id in self._pending_decisions():
+            if plan_decision_id < decision_id:
+                self._remove(self.pending_dir, plan_id)
+
+    def _prune(self):
+        # Delivered plans the robot never acknowledged
+        now = time.time()
+        for name in os.listdir(self.delivered_dir):
+            path = os.path.join(self.delivered_dir, name)
+            try:
+                if now - os.stat(path).st_mtime > DELIVERED_RETENTION_SEC:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _remove(self, directory, plan_id):
+        try:
+            os.remove(os.path.join(directory, _plan_file(plan_id)))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def consume(self):
+        """
+        Take the oldest pending plan.
+
+        Returns:
+            dict: plan with its "plan_id" or None if there are no pending plans
+        """
+        for plan_id in _plan_ids(self.pending_dir):
+            delivered_path = os.path.join(self.delivered_dir, _plan_file(plan_id))
+            try:
+                os.rename(os.path.join(self.pending_dir, _plan_file(plan_id)), delivered_path)
+            except FileNotFoundError:
+                # Taken by another request or pruned, try the next one
+                continue
+            # Renames keep the mtime, touch it so retention counts from the delivery
+            os.utime(delivered_path)
+            with open(delivered_path, "r") as f:
+                return json.load(f)
+        return None
+
+    def ack(self, plan_id):
+        # The robot executed the plan. False if it was not delivered or already acknowledged.
+        return self._remove(self.delivered_dir, plan_id)
+
+    def depth(self):
+        # Number of pending plans
+        return len(_plan_ids(self.pending_dir))
+
+    def oldest_age(self):
+        # Seconds since the oldest pending plan was published, None if there are none
+        for plan_id in _plan_ids(self.pending_dir):
+            try:
+                return time.time() - os.stat(os.path.join(self.pending_dir, _plan_file(plan_id))).st_mtime
+            except FileNotFoundError:
+                continue
+        return None
@@ -0,0 +1,103 @@
+#!/usr/bin/python
+# Incremental parser of the JSON answer of the model, fed with the text as it is
+# generated, so llm.py sends every element of "steps" to the robot as soon as it is
+# complete instead of waiting for "thoughts" and "description".
+#
+# Text before the first "{" (e.g. a ```json fence) and after the object is ignored.
+import json
+
+class StepStreamParser:
+    """
+    Finds the elements of the "steps" array of a JSON object while it is written.
+
+    Args:
+        key (str): name of the array in the top level object
+    """
+
+    def __init__(self, key="steps"):
+        self.key = key
+        self.buffer = ""
+        # Next character of buffer to scan
+        self.position = 0
+        # Open "{" and "[", True for the array of steps
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        # Last string closed in the top level object, the key of the next value
+        self.last_string = None
+        self.root_start = None
+        self.root_end = None
+        self.step_start = None
+
+    def feed(self, text):
+        """
+        Add generated text.
+
+        Returns:
+            list: steps completed by this text, parsed
+        """
+        self.buffer += text
+        steps = []
+        buffer = self.buffer
+        for position in range(self.position, len(buffer)):
+            if self.root_end is not None:
+                break
+            char = buffer[position]
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if len(self.stack) == 1:
+                        self.last_string = buffer[self.string_start + 1:position]
+                continue
+
+            if self.root_start is None:
+                # Before the object
+                if char == "{":
+                    self.root_start = position
+                    self.stack.append(False)
+                continue
+
+            in_steps = len(self.stack) == 2 and self.stack[1]
+            if in_steps and self.step_start is None and char not in " \t\r\n,]":
+                self.step_start = position
+
+            if char == '"':
+                self.in_string = True
+                self.string_start = position
+            elif char in "{[":
+                self.stack.append(char == "[" and len(self.stack) == 1 and self.last_string == self.key)
+            elif char in "}]":
+                if in_steps and char == "]" and self.step_start is not None:
+                    # Last element is a number, true, false or null
+                    steps.append(self._step(position))
+                self.stack.pop()
+                if not self.stack:
+                    self.root_end = position
+                elif len(self.stack) == 2 and self.stack[1] and self.step_start is not None:
+                    steps.append(self._step(position + 1))
+            elif char == "," and in_steps and self.step_start is not None:
+                steps.append(self._step(position))
+        self.position = len(buffer)
+        return steps
+
+    def _step(self, end):
+        step = json.loads(self.buffer[self.step_start:end])
+        self.step_start = None
+        return step
+
+    def result(self):
+        """
+        The whole object once the text is complete.
+
+        Raises:
+            ValueError: the text did not have a complete JSON object
+        """
+        if self.root_end is None:
+            raise ValueError("incomplete JSON object in the answer of the model")
+        return json.loads(self.buffer[self.root_start:self.root_end + 1])
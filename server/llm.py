@@ -21,10 +21,9 @@
 # - summaries: we could generate a summary at the end of the day or even
 # - dream-like processing
 
-EVENTS_FILE="/usr/local/src/data/event.log"
-#EVENTS_FILE="/var/snap/microk8s/common/default-storage/vikare-data-vikare-0-pvc-f6691cc9-b357-40e7-b210-afc10fca6d73/event.log"
-IMAGES_DIRECTORY="/usr/local/src/data/images"
-#IMAGES_DIRECTORY="/var/snap/microk8s/common/default-storage/vikare-data-vikare-0-pvc-f6691cc9-b357-40e7-b210-afc10fca6d73/images"
+# Events, images and instructions are on the PVC, under VIKARE_DATA_DIR like for the
+# servers (see ingest.py), e.g. outside the cluster:
+#VIKARE_DATA_DIR=/var/snap/microk8s/common/default-storage/vikare-data-vikare-0-pvc-f6691cc9-b357-40e7-b210-afc10fca6d73
 # FINAL_PROMPT = """
 # You are the brain of an autonomous robot. 
 # Your task is to decide the next action based on:
@@ -82,7 +81,9 @@ Your task is to decide the next action based on:
 
 1. **Camera image** (provided directly as part of the context).
 2. **Sensors data**: distances, obstacles, battery, temperature, tilt, etc.
-3. **Current goal**: what you are trying to achieve right now.
+3. **Memory**: a summary of older decisions, then past decisions similar to the current
+   situation and the latest ones, each with its actions, thoughts and outcome.
+4. **Current goal**: what you are trying to achieve right now.
 
 ### Possible actions
 - `forward` (distance in cm)
@@ -106,22 +107,76 @@ Respond **only** in valid JSON (no extra text) with the following structure:
 }}
 """
 
+# Static part of every request, first so ollama can reuse it (see llm_messages)
+SYSTEM_PROMPT = PROMPT.format()
+# Changes on every request
+CONTEXT_PROMPT = """
+### Context
+Sensors: {sensors_data}
+Memory:
+{memory}
+Current goal: {current_goal}
+"""
+
 current_goal = "Look for and push the ball."
 
 import os
 import json
 import datetime
+import threading
 import time
 import ollama
-import yaml
-
-def get_latest_event(events_file=EVENTS_FILE):
-    with open(events_file, "rb") as f:
-        lines = f.readlines()
-        last_line = lines[-1].decode("utf-8")
-        #print(last_line)
-        
-    event = json.loads(last_line)
+from eventlog import latest_event, latest_events, find_segment
+from framebuffer import FrameClient
+from frames import FrameIndex
+from ingest import EVENTS_DIR, IMAGES_DIR, INSTRUCTIONS_DIR
+from imagecache import ImagePayloadCache
+from instructions import InstructionQueue
+from jsonstream import StepStreamParser
+from memory import MEMORY_EMBED_MODEL, MemoryStore, OllamaEmbedder, estimate_tokens
+from metrics import write_textfile
+from state import SharedState
+from timeseries import SensorHistory
+
+# Latest sensors and frame published by sensors.py and image.py
+shared_state = SharedState(subscriber="llm")
+# Sensors history appended by sensors.py
+sensor_history = SensorHistory()
+# Plans for the robot, delivered by sensors.py
+instruction_queue = InstructionQueue(INSTRUCTIONS_DIR)
+# Last frames kept in memory by image.py
+frame_client = FrameClient()
+frame_server_up = True
+# Images already encoded for the model
+image_cache = ImagePayloadCache()
+# Model and how long ollama keeps it loaded after each request, e.g. "30m", -1 forever
+LLM_MODEL = os.environ.get("LLM_MODEL", "gemma3:12b")
+LLM_KEEP_ALIVE = os.environ.get("LLM_KEEP_ALIVE", "30m")
+if LLM_KEEP_ALIVE.lstrip("-").isdigit():
+    # Plain numbers are seconds for ollama, only as a number and not as a string
+    LLM_KEEP_ALIVE = int(LLM_KEEP_ALIVE)
+# One HTTP connection kept open to ollama (OLLAMA_HOST)
+ollama_client = ollama.Client()
+# Past decisions and their outcome, see memory.py
+memory_store = MemoryStore(embed=OllamaEmbedder(ollama_client, MEMORY_EMBED_MODEL) if MEMORY_EMBED_MODEL else None)
+# Frames saved by image.py by time, one index per camera
+frame_indexes = {}
+# Camera used before image.py publishes its cameras
+DEFAULT_CAMERA = "front"
+# Served by image.py when it builds a mosaic of the frames (see mosaic.py)
+MOSAIC_CAMERA = "mosaic"
+# Resolution of the frames sent to the model, encoded by image.py (see variants.py)
+LLM_IMAGE_VARIANT = "llm"
+# Frames further than this from the sensors are not used
+CLOSEST_IMAGE_TOLERANCE_MS = 5000
+
+def get_latest_event(events_dir=EVENTS_DIR):
+    # Latest reading from shared memory, the event log only if nothing was published
+    # since the pod started
+    event, _ = shared_state.read("sensors")
+    if event is None:
+        # Seek from the end of the newest segment instead of reading the whole log
+        event = latest_event(events_dir)
 
     # Add datetime from time string
     target_time = event["time"]
@@ -131,140 +186,430 @@ def get_latest_event(events_file=EVENTS_FILE):
     
     return event
 
-def find_closest_image_path(image_dir=IMAGES_DIRECTORY, target_time=None):
-    if target_time is None:
+def get_latest_events(events_dir=EVENTS_DIR, count=10):
+    # Last events, oldest first
+    return latest_events(events_dir, count)
+
+def get_sensor_window(field, seconds=30):
+    # Values and summary of one sensor in the last seconds, e.g. get_sensor_window("compass")
+    now = time.time()
+    values = sensor_history.last(field, seconds, now=now)
+    return values, sensor_history.aggregate(field, now - seconds, now)
+
+def get_events_segment(timestamp, events_dir=EVENTS_DIR):
+    # Path of the segment with the events received around timestamp (epoch seconds)
+    return find_segment(events_dir, timestamp)
+
+def get_default_camera():
+    # Camera the LLM looks at unless asked for another one, the first one of image.py
+    frames, _ = shared_state.read("frame")
+    if frames is None:
+        return DEFAULT_CAMERA
+    return frames["default"]
+
+def get_latest_frame(camera=None):
+    # Metadata of the last frame kept by image.py for a camera (the default one if None),
+    # None if there is none
+    frames, _ = shared_state.read("frame")
+    if frames is None:
         return None
-    
-    images = os.listdir(image_dir)
-    images = [img for img in images if img.endswith(".jpg")]
-    images.sort()
-    
-    def extract_ts(filename):
-        ts_str = filename.replace(".jpg", "")
-        return datetime.datetime.strptime(ts_str, "%Y-%m-%d-%H-%M-%S-%f")
-    
-    # Can be more efficient using a while starting by the end of the list and moving backwards ... but for now it's fine
-    closest = min(images, key=lambda x: abs(extract_ts(x) - target_time))
-
-    return os.path.join(image_dir, closest)
-
-def resize_image (image_path, percentage=0.25):
-
-    # Load the image
-    img = cv2.imread(image_path)
-
-    # Scale to 25%
-    width = int(img.shape[1] * percentage)
-    height = int(img.shape[0] * percentage)
-    dim = (width, height)
-
-    # Resize
-    resized = cv2.resize(img, dim, interpolation=cv2.INTER_AREA)
+    return frames["cameras"].get(camera or frames["default"])
+
+def get_latest_image_path(camera=None):
+    # Path and timestamp (epoch seconds) of the last frame saved by image.py
+    frame = get_latest_frame(camera)
+    if frame is None or frame.get("path") is None:
+        # Nothing saved yet or image.py does not archive the frames
+        return None, None
+    return frame["path"], frame["time"]
+
+def get_latest_image(camera=None, variant=LLM_IMAGE_VARIANT):
+    # Base64 JPEG, ready for the model, and timestamp of the newest frame from image.py
+    # memory at the resolution encoded for the model when the frame was captured (see
+    # variants.py), (None, None) if image.py is not serving frames. Only fetched and
+    # encoded the first time a frame is used.
+    global frame_server_up
+    try:
+        metadata, _ = frame_client.latest(camera, variant, head=True)
+        if metadata is None:
+            frame_server_up = True
+            return None, None
+        key = (camera, metadata.get("frame_id"), metadata["time"], metadata["variant"])
+        payload = image_cache.get(key, lambda: frame_client.nearest(metadata["time"], 0, camera, variant)[1])
+    except OSError as e:
+        # Once, not on every context prepared while image.py is down
+        if frame_server_up:
+            print(f"Error getting the frame from image.py: {e}", flush=True)
+        frame_server_up = False
+        return None, None
+    frame_server_up = True
+    if payload is None:
+        return None, None
+    return payload, metadata["time"]
+
+def get_image_file(path):
+    # Base64 of a frame saved by image.py, read from the PVC only the first time
+    def load():
+        with open(path, "rb") as f:
+            return f.read()
+    return image_cache.get(("file", path), load)
+
+def get_frame_change(camera=None):
+    # How much the scene changed in the newest frame kept by image.py, from 0 to 1
+    # (see framediff.py), None if unknown
+    frame = get_latest_frame(camera)
+    if frame is None:
+        return None
+    return frame.get("change")
 
-    # Save resulting image
-    cv2.imwrite("resized_" + image_path, resized)
-    
-    return("resized_" + image_path)
+def get_frame_index(camera):
+    # Index of the frames saved for a camera, read incrementally (see frames.py)
+    if camera not in frame_indexes:
+        frame_indexes[camera] = FrameIndex(os.path.join(IMAGES_DIR, camera))
+    return frame_indexes[camera]
 
+def find_closest_image_path(target_time=None, tolerance_ms=CLOSEST_IMAGE_TOLERANCE_MS, camera=None):
+    # Path of the frame of a camera (the default one if None) saved closest to target_time
+    # (epoch seconds), None if there is none within tolerance_ms
+    if target_time is None:
+        return None
+    return get_frame_index(camera or get_default_camera()).nearest(target_time, tolerance_ms)
 
-def query_llm(sensors_data, image_path, current_goal, PROMPT=PROMPT):
+def find_closest_image_paths(target_time=None, tolerance_ms=CLOSEST_IMAGE_TOLERANCE_MS):
+    # Same as find_closest_image_path for every camera with saved frames: camera -> path
+    if target_time is None:
+        return {}
+    cameras = sorted(entry.name for entry in os.scandir(IMAGES_DIR) if entry.is_dir())
+    return {camera: get_frame_index(camera).nearest(target_time, tolerance_ms) for camera in cameras}
+
+def parse_answer(content):
+    # JSON object of a complete answer, without the ``` fence around it
+    parser = StepStreamParser()
+    parser.feed(content)
+    return parser.result()
+
+def llm_messages(sensors_data, image, current_goal, system_prompt=SYSTEM_PROMPT, memory=""):
+    # The system prompt never changes and goes first, so ollama reuses its evaluation
+    # from the previous request: only the context below is new every time
+    return [
+        {"role": "system", "content": system_prompt},
+        {
+           "role": "user",
+           "content": CONTEXT_PROMPT.format(sensors_data=json.dumps(sensors_data, default=str),
+                                            memory=memory or "none", current_goal=current_goal),
+           # Without image if there are no frames yet
+           "images": [image] if image is not None else []
+        },
+    ]
+
+def ollama_stats(response):
+    # Seconds and tokens reported by ollama in the last chunk of an answer
+    stats = {}
+    for name in ("load_duration", "prompt_eval_duration", "eval_duration"):
+        value = getattr(response, name, None)
+        if value is not None:
+            stats[name] = value / 1e9
+    for name in ("prompt_eval_count", "eval_count"):
+        value = getattr(response, name, None)
+        if value is not None:
+            stats[name] = value
+    return stats
+
+def query_llm(sensors_data, image, current_goal, PROMPT=SYSTEM_PROMPT, on_step=None, stats=None, memory=""):
     """
     Query gemma3:12b model with sensors data an image.
   
     Args:
         sensor_data (dict): data from robot (json)
-        image_path (str): path to image
+        image (str or bytes): base64 JPEG, path to image or JPEG bytes
         current_goal (str): finish to achieve
-        base_url (str): Ollama service URL
+        PROMPT (str): system prompt
+        on_step (function): streams the answer and calls it with each element of
+                            "steps" as soon as the model completes it
+        stats (dict): filled with "ttft" (seconds to the first token, streaming only),
+                      "latency" and the durations and token counts reported by ollama
+        memory (str): memories of past decisions, see MemoryStore.recall
   
     Returns:
-        str: model response
+        dict: model response
     """
+    if stats is None:
+        stats = {}
+    messages = llm_messages(sensors_data, image, current_goal, PROMPT, memory)
+    start = time.perf_counter()
+
+    if on_step is None:
+        response = ollama_client.chat(model=LLM_MODEL, messages=messages, keep_alive=LLM_KEEP_ALIVE)
+        stats["latency"] = time.perf_counter() - start
+        stats.update(ollama_stats(response))
+        #print("###### BEGIN LLM ######")
+        #print(response.message.content)
+        #print("###### END LLM ######")
+        return parse_answer(response.message.content)
+
+    # Steps leave while the model is still writing the rest of the answer
+    parser = StepStreamParser()
+    for chunk in ollama_client.chat(model=LLM_MODEL, messages=messages, keep_alive=LLM_KEEP_ALIVE,
+                                    stream=True):
+        if "ttft" not in stats and chunk.message.content:
+            stats["ttft"] = time.perf_counter() - start
+        for step in parser.feed(chunk.message.content):
+            on_step(step)
+        if chunk.done:
+            stats.update(ollama_stats(chunk))
+    stats["latency"] = time.perf_counter() - start
+    return parser.result()
+
+def warm_up(system_prompt=SYSTEM_PROMPT):
+    # Load the model and evaluate the system prompt before the first decision
+    start = time.perf_counter()
+    try:
+        response = ollama_client.chat(model=LLM_MODEL, keep_alive=LLM_KEEP_ALIVE, options={"num_predict": 1},
+                                      messages=[{"role": "system", "content": system_prompt}])
+    except Exception as e:
+        print(f"Error warming up {LLM_MODEL}: {e}", flush=True)
+        return
+    print(f"{LLM_MODEL} warm in {time.perf_counter() - start:.1f}s {ollama_stats(response)}", flush=True)
+
+def execute_instructions(instructions, decision_id=None):
+    # Publish the plan in the queue delivered to the ESP32 (see instructions.py). A new
+    # decision (decision_id None) replaces the plans of the previous ones not taken yet.
+    # Returns the plan id, None if the queue refused it.
+    plan_id = instruction_queue.publish(instructions, decision_id)
+    if plan_id is None:
+        # Too many steps of the decision still waiting for the robot
+        return None
 
-    #print ("### BEGIN SENSORS ###")
-    #print("sensors_data: " + str(sensors_data))
-    #print ("### END SENSORS ###")
-    #print("current_goal: " + current_goal)
-
-    composed_prompt = PROMPT.format(sensors_data=sensors_data, current_goal=current_goal)
-    #print(composed_prompt)
-
-    response = ollama.chat(
-        model="gemma3:12b",
-        messages=[
-            {
-               "role": "user",
-               "content": composed_prompt,
-               "images": [image_path]
-            }
-       ] 
-    )
-    #print("###### BEGIN LLM ######")
-    #print(response.message.content)
-    #print("###### END LLM ######")
-    
-    # Extract only the JSON block from answer
-    raw = response.message.content.splitlines()
-    inside_block = False
-    filtered_lines = []
-  
-    for line in raw:
-        if line.strip().startswith("```"):
-            inside_block = not inside_block
-            continue
-        if inside_block:
-            filtered_lines.append(line)
-  
-    json_str = "\n".join(filtered_lines).strip()
-    parsed = json.loads(json_str)
-    # print(parsed)
-
-    return(parsed)
+    # Wake up the requests of the robot waiting for instructions
+    shared_state.write("instructions", {"plan_id": plan_id})
 
-def execute_instructions(instructions):
-    # Save instructions in yaml to be interpreted by ESP32
-    #output_path = "/var/snap/microk8s/common/default-storage/vikare-data-vikare-0-pvc-f6691cc9-b357-40e7-b210-afc10fca6d73/instructions.yaml"
-    output_path = "/usr/local/src/data/instructions.yaml"
+    #print(f"Plan {plan_id} published")
+    #print(instructions)
+    return plan_id
 
-    with open(output_path, "w") as f:
-        yaml.dump(instructions, f, indent=2, allow_unicode=True)
 
-    #print(f"Instructions saved in {output_path}")
-    #print(instructions)
+# Maximum seconds waiting for new sensors or frames before deciding anyway
+STATE_WAIT_TIMEOUT_SEC = 30
+# Minimum seconds between the start of two decisions, replaces a fixed sleep
+MIN_DECISION_INTERVAL_SEC = float(os.environ.get("MIN_DECISION_INTERVAL_SEC", 1))
+# Publish each step as soon as the model writes it instead of the whole plan at the end
+LLM_STREAM = os.environ.get("LLM_STREAM", "1") == "1"
 
+def prepare_context():
+    """
+    Everything a decision needs besides the model: sensors and image.
 
-while True:
-    print ("########### LOOP BEGIN ############")
-    ## inputs
+    Returns:
+        dict: "sensors", "sensors_time", "image" (base64 JPEG), "image_path",
+              "image_time", "scene_change" and "timings" (stage -> seconds)
+    """
+    timings = {}
+    start = time.perf_counter()
     # esp32 and roomba sensors
-    sensors = get_latest_event(events_file=EVENTS_FILE)
-    
-    print("SENSORS: ")
-    print(json.dumps(sensors, indent=4, default=str))
-    # print(json.dumps(json.loads(str(sensors)), indent=4))
-    # image
-    image_path = find_closest_image_path(image_dir=IMAGES_DIRECTORY, target_time=sensors["datetime"])
-
-    # current_goal comes from above
-    current_goal = current_goal
-
-    ## query gemma3:12b using ollama
-    print("IMAGE PATH:")
-    print(image_path)
-
-    #time.sleep(60)
-    response = query_llm(sensors, image_path, current_goal)
-    print("LLM ANSWER: ")
-    print(json.dumps(response, indent=4, default=str))
-
-    instructions={}
-    instructions["steps"] = response["steps"]
-    ## execute instructions to move the roomba
-    execute_instructions(instructions)
-    
-    print("############ LOOP END ###############3")
-    print ("\n")
-    print ("\n")
+    sensors = get_latest_event(events_dir=EVENTS_DIR)
+    _, sensors_time = shared_state.read("sensors")
+    if sensors_time is None and sensors.get("datetime"):
+        # Read from the event log, its time is UTC like the frame names
+        sensors_time = sensors["datetime"].replace(tzinfo=datetime.timezone.utc).timestamp()
+    timings["sensors"] = time.perf_counter() - start
+
+    # From image.py memory, the mosaic if it builds one, the archive on the PVC only if
+    # image.py is not serving frames
+    start = time.perf_counter()
+    image, image_time = get_latest_image(MOSAIC_CAMERA)
+    if image is None:
+        image, image_time = get_latest_image()
+    image_path = "<memory>"
+    if image is None:
+        image_path, image_time = get_latest_image_path()
+        if image_path is None:
+            image_path = find_closest_image_path(target_time=sensors_time)
+        image = None if image_path is None else get_image_file(image_path)
+    timings["image"] = time.perf_counter() - start
+
+    return {
+        "sensors": sensors,
+        "sensors_time": sensors_time,
+        "image": image,
+        "image_path": image_path,
+        "image_time": image_time,
+        # Frames are only published when the scene changed, see image.py
+        "scene_change": get_frame_change(),
+        "timings": timings,
+    }
+
+class ContextPreparer:
+    """
+    Thread preparing the context of the next decision every time sensors.py or
+    image.py publish something new, also while the model runs the current one, so
+    a decision starts with a fresh context and without waiting for it.
+    """
 
-    time.sleep(7)
-    #exit(0)
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.context = None
+        # Increases with every context prepared
+        self.context_id = 0
+        self.thread = threading.Thread(target=self._run, name="context-preparer", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        state_sequence = 0
+        while True:
+            try:
+                context = prepare_context()
+            except Exception as e:
+                print(f"Error preparing the context: {e}", flush=True)
+                context = None
+            if context is not None:
+                with self.condition:
+                    self.context = context
+                    self.context_id += 1
+                    self.condition.notify_all()
+            # Block until sensors.py or image.py publish something new
+            state_sequence = shared_state.wait(state_sequence, timeout=STATE_WAIT_TIMEOUT_SEC,
+                                               slots=["sensors", "frame"])
+
+    def take(self, after_id):
+        """
+        Newest context, waiting until there is one newer than after_id.
+
+        Returns:
+            tuple: (context id, context)
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.context_id > after_id)
+            return self.context_id, self.context
+
+def report_timings(timings, decisions, image_bytes, image_bytes_total, prompt_tokens=None, memory_tokens=None):
+    # Seconds of each stage of the last decision and image sent, in the logs and in /metrics
+    print("TIMINGS: " + " ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in timings.items()),
+          flush=True)
+    hit_rate = image_cache.hit_rate()
+    print(f"IMAGE: {image_bytes} bytes sent, cache hit rate "
+          f"{'-' if hit_rate is None else f'{hit_rate:.2f}'}", flush=True)
+    write_textfile("llm", [
+        (f'vikare_llm_stage_seconds{{stage="{stage}"}}', "gauge",
+         "Seconds of each stage of the last decision.", seconds)
+        for stage, seconds in timings.items()
+    ] + [
+        ("vikare_llm_decisions_total", "counter", "Decisions made by the model.", decisions),
+        ("vikare_llm_image_bytes", "gauge", "Bytes of the image sent in the last request.", image_bytes),
+        ("vikare_llm_image_bytes_total", "counter", "Bytes of the images sent to the model.",
+         image_bytes_total),
+        # Drops when ollama reuses the system prompt, jumps when the model was reloaded
+        ("vikare_llm_prompt_tokens", "gauge", "Prompt tokens evaluated in the last request.", prompt_tokens),
+        ("vikare_llm_memories", "gauge", "Decisions kept in the long term memory.", len(memory_store)),
+        ("vikare_llm_memory_tokens", "gauge", "Estimated tokens of the memories in the last request.",
+         memory_tokens),
+        ("vikare_llm_image_cache_hits_total", "counter", "Images found already encoded.", image_cache.hits),
+        ("vikare_llm_image_cache_misses_total", "counter", "Images fetched and encoded.", image_cache.misses),
+        ("vikare_llm_image_cache_bytes", "gauge", "Bytes of the encoded images kept.", image_cache.total_bytes),
+    ])
+
+def main():
+    # The model loads while the first context is prepared
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    preparer = ContextPreparer()
+    context_id = 0
+    decisions = 0
+    image_bytes_total = 0
+    last_decision = None
+    # Last decision, remembered with the sensors of the next one as its outcome
+    pending_memory = None
+
+    while True:
+        # Not more often than MIN_DECISION_INTERVAL_SEC, even if the state changes faster
+        if last_decision is not None:
+            remaining = last_decision + MIN_DECISION_INTERVAL_SEC - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+
+        start = time.monotonic()
+        context_id, context = preparer.take(context_id)
+        last_decision = time.monotonic()
+        timings = dict(context["timings"])
+        # Time waiting for something new, 0 if it was prepared during the last decision
+        timings["wait"] = last_decision - start
+
+        print ("########### LOOP BEGIN ############")
+        print("SENSORS: ")
+        print(json.dumps(context["sensors"], indent=4, default=str))
+        print("IMAGE PATH:")
+        print(context["image_path"])
+        print(f"SCENE CHANGE: {context['scene_change']}")
+
+        start = time.perf_counter()
+        # Without the times, the memory has its own
+        sensors = {key: value for key, value in context["sensors"].items() if key not in ("time", "datetime")}
+        if pending_memory is not None:
+            decision_time, answer, goal = pending_memory
+            memory_store.append(decision_time, answer, goal,
+                                {"sensors": sensors, "scene_change": context["scene_change"]})
+            pending_memory = None
+        memory, memory_count = memory_store.recall(f"goal: {current_goal}; sensors: {json.dumps(sensors, default=str)}")
+        timings["memory"] = time.perf_counter() - start
+        print(f"MEMORY: {memory_count} of {len(memory_store)} memories")
+
+        ## query gemma3:12b using ollama
+        start = time.perf_counter()
+        published = []
+        published_steps = []
+        dropped = []
+
+        def publish_step(step):
+            # Each step is a plan of its own, the robot runs them in order. The first one
+            # starts the decision, the next ones continue it.
+            # Once one is refused, the rest of the decision too: the robot never skips one.
+            if not published:
+                timings["first_step"] = time.perf_counter() - start
+            plan_id = None
+            if not dropped:
+                plan_id = execute_instructions({"steps": [step]}, published[0] if published else None)
+            if plan_id is None:
+                print(f"STEP DROPPED, robot behind: {json.dumps(step)}", flush=True)
+                dropped.append(step)
+                return
+            published.append(plan_id)
+            published_steps.append(step)
+            print(f"STEP PUBLISHED: {json.dumps(step)}", flush=True)
+
+        llm_stats = {}
+        try:
+            response = query_llm(context["sensors"], context["image"], current_goal,
+                                 on_step=publish_step if LLM_STREAM else None, stats=llm_stats, memory=memory)
+        except Exception as e:
+            # Bad answer or ollama unreachable: the steps already published still run and
+            # are remembered, the next decision starts from a fresh context
+            print(f"Error querying {LLM_MODEL}: {e}", flush=True)
+            if published_steps:
+                pending_memory = (time.time(), {"steps": published_steps, "thoughts": f"answer cut: {e}"},
+                                  current_goal)
+            continue
+        timings["inference"] = time.perf_counter() - start
+        if "ttft" in llm_stats:
+            timings["ttft"] = llm_stats["ttft"]
+        print(f"LLM STATS: {json.dumps(llm_stats)}", flush=True)
+        print("LLM ANSWER: ")
+        print(json.dumps(response, indent=4, default=str))
+
+        ## execute instructions to move the roomba
+        if not LLM_STREAM:
+            start = time.perf_counter()
+            execute_instructions({"steps": response["steps"]})
+            timings["publish"] = time.perf_counter() - start
+        timings["decision"] = time.monotonic() - last_decision
+        # Only the steps the robot got, some may have been refused
+        pending_memory = (time.time(), dict(response, steps=published_steps) if LLM_STREAM else response,
+                          current_goal)
+
+        decisions += 1
+        image_bytes = len(context["image"] or "")
+        image_bytes_total += image_bytes
+        report_timings(timings, decisions, image_bytes, image_bytes_total, llm_stats.get("prompt_eval_count"),
+                       estimate_tokens(memory))
+        print("############ LOOP END ###############")
+        print ("\n")
+
+if __name__ == '__main__':
+    main()
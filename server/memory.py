@@ -0,0 +1,314 @@
+#!/usr/bin/python
+# Long term memory of llm.py: every decision with its outcome, so the next prompts
+# include what the robot did before in a similar situation and what happened.
+#
+# Only the last MEMORY_MAX_ENTRIES decisions are kept with their embedding, older ones
+# are folded into a rolling summary (period, actions and goals), and the memories put
+# in a prompt never exceed MEMORY_PROMPT_TOKENS, so the prompt and the inference time
+# stay the same however long the robot runs.
+#
+# On disk, in MEMORY_DIR:
+#   memories.jsonl  one decision per line with its embedding, append only, rewritten
+#                   with only the entries kept when it has MEMORY_COMPACT_RATIO times
+#                   more lines, like the frames manifest (see frames.py)
+#   summary.json    the rolling summary and the time of the last decision folded in
+import base64
+import collections
+import datetime
+import json
+import os
+import re
+import threading
+import zlib
+import numpy as np
+from ingest import DATA_DIR
+
+MEMORY_DIR = os.environ.get("MEMORY_DIR", os.path.join(DATA_DIR, "memory"))
+MEMORY_MAX_ENTRIES = int(os.environ.get("MEMORY_MAX_ENTRIES", 2000))
+# Memories retrieved by similarity and most recent ones always included
+MEMORY_TOP_K = int(os.environ.get("MEMORY_TOP_K", 5))
+MEMORY_RECENT = int(os.environ.get("MEMORY_RECENT", 2))
+# Tokens of the summary and memories in each prompt
+MEMORY_PROMPT_TOKENS = int(os.environ.get("MEMORY_PROMPT_TOKENS", 400))
+# Embedding model in ollama, empty to use HashingEmbedder
+MEMORY_EMBED_MODEL = os.environ.get("MEMORY_EMBED_MODEL", "")
+MEMORY_COMPACT_RATIO = 4
+MEMORIES_FILE = "memories.jsonl"
+SUMMARY_FILE = "summary.json"
+# Goals listed in the summary
+SUMMARY_GOALS = 5
+# Characters of the outcome kept in each memory
+OUTCOME_MAX_CHARS = 300
+
+def estimate_tokens(text):
+    # Close enough for a budget, ~4 characters per token
+    return (len(text) + 3) // 4
+
+def _action(step):
+    # ({"forward": 50}) -> ("forward", 50)
+    if isinstance(step, dict) and len(step) == 1:
+        return next(iter(step.items()))
+    return str(step), None
+
+class HashingEmbedder:
+    """
+    Bag of words and word pairs hashed into a fixed size vector. Needs no model and
+    takes microseconds, enough to match the goals, actions and sensors of the memories.
+
+    Args:
+        dim (int): size of the vectors
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def __call__(self, text):
+        words = re.findall(r"[a-z0-9_]+", text.lower())
+        vector = np.zeros(self.dim, np.float32)
+        for feature in words + [a + " " + b for a, b in zip(words, words[1:])]:
+            h = zlib.crc32(feature.encode())
+            vector[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return vector
+
+class OllamaEmbedder:
+    """
+    Embeddings of an ollama model, e.g. nomic-embed-text: better matches than
+    HashingEmbedder for a request to ollama per decision.
+
+    Args:
+        client (ollama.Client): client used by llm.py
+        model (str): embedding model
+    """
+
+    def __init__(self, client, model):
+        self.client = client
+        self.model = model
+        self.name = f"ollama-{model}"
+
+    def __call__(self, text):
+        return self.client.embed(model=self.model, input=text).embeddings[0]
+
+class MemoryStore:
+    """
+    Decisions and their outcome, retrieved by cosine similarity within a token budget.
+
+    Args:
+        directory (str): where the memories and the summary are saved, None to not save them
+        embed (function): text -> vector, e.g. HashingEmbedder or ollama embeddings.
+                          Its "name" attribute, if any, is saved with the vectors so they
+                          are computed again when it changes
+        max_entries (int): memories kept with their embedding
+    """
+
+    def __init__(self, directory=MEMORY_DIR, embed=None, max_entries=MEMORY_MAX_ENTRIES):
+        self.directory = directory
+        self.embed = embed or HashingEmbedder()
+        self.embed_name = getattr(self.embed, "name", None)
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # Oldest first, each with its row of vectors
+        self.entries = collections.deque()
+        # Unit vectors of the entries, used as a ring: row of each entry in "row"
+        self.vectors = None
+        self.next_row = 0
+        self.summary = {"since": None, "until": None, "decisions": 0, "actions": {}, "goals": []}
+        self.file = None
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self.path = os.path.join(directory, MEMORIES_FILE)
+            self.summary_path = os.path.join(directory, SUMMARY_FILE)
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.summary_path) as f:
+                self.summary = json.load(f)
+        except (FileNotFoundError, ValueError):
+            pass
+        folded = self.summary["until"]
+        try:
+            with open(self.path) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            lines = []
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Last line cut by a crash
+                continue
+            if folded is not None and entry["time"] <= folded:
+                continue
+            vector = None
+            if entry.get("embedder") == self.embed_name and "embedding" in entry:
+                vector = np.frombuffer(base64.b64decode(entry["embedding"]), np.float32)
+            self._add(entry, vector)
+        self._compact()
+
+    def _compact(self):
+        # File with only the entries kept, replaced atomically
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.writelines(self._line(entry) for entry in self.entries)
+        os.replace(tmp_path, self.path)
+        if self.file is not None:
+            self.file.close()
+        self.file = open(self.path, "a")
+        self.file_entries = len(self.entries)
+        self._save_summary()
+
+    def _line(self, entry):
+        row = entry["row"]
+        saved = {key: value for key, value in entry.items() if key != "row"}
+        saved["embedder"] = self.embed_name
+        saved["embedding"] = base64.b64encode(self.vectors[row].tobytes()).decode()
+        return json.dumps(saved, default=str) + "\n"
+
+    def _save_summary(self):
+        tmp_path = self.summary_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.summary, f)
+        os.replace(tmp_path, self.summary_path)
+
+    @staticmethod
+    def text(entry):
+        # What is embedded and shown to the model for a memory
+        actions = ", ".join(f"{name} {value}" if value is not None else name
+                            for name, value in map(_action, entry["steps"]))
+        return (f"[{entry['datetime']}] goal: {entry['goal']}; actions: {actions or 'none'}; "
+                f"thoughts: {entry['thoughts']}; outcome: {entry['outcome']}")
+
+    def _vector(self, text):
+        vector = np.asarray(self.embed(text), np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _add(self, entry, vector=None):
+        # True if the oldest memory was folded into the summary to make room
+        folded = False
+        if vector is None:
+            vector = self._vector(self.text(entry))
+        if self.vectors is None:
+            self.vectors = np.zeros((self.max_entries, len(vector)), np.float32)
+        if len(self.entries) == self.max_entries:
+            self._fold(self.entries.popleft())
+            folded = True
+        entry["row"] = self.next_row
+        self.vectors[self.next_row] = vector
+        self.next_row = (self.next_row + 1) % self.max_entries
+        self.entries.append(entry)
+        return folded
+
+    def _fold(self, entry):
+        # Add a memory evicted from the store to the rolling summary
+        summary = self.summary
+        if summary["since"] is None:
+            summary["since"] = entry["datetime"]
+        summary["until"] = entry["time"]
+        summary["until_datetime"] = entry["datetime"]
+        summary["decisions"] += 1
+        for name, value in map(_action, entry["steps"]):
+            total = summary["actions"].setdefault(name, {"count": 0, "total": 0})
+            total["count"] += 1
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                total["total"] += value
+        if entry["goal"]:
+            # Latest distinct goals
+            goals = [goal for goal in summary["goals"] if goal != entry["goal"]]
+            summary["goals"] = (goals + [entry["goal"]])[-SUMMARY_GOALS:]
+
+    def append(self, timestamp, answer, goal, outcome):
+        """
+        Remember a decision once its outcome is known.
+
+        Args:
+            timestamp (float): epoch seconds of the decision
+            answer (dict): answer of the model, with "steps" and "thoughts"
+            goal (str): goal of the decision
+            outcome: what happened after it, e.g. the sensors of the next decision
+        """
+        if not isinstance(outcome, str):
+            outcome = json.dumps(outcome, default=str)
+        entry = {
+            "time": timestamp,
+            "datetime": datetime.datetime.fromtimestamp(timestamp).isoformat(timespec="seconds"),
+            "goal": goal,
+            "steps": answer.get("steps") or [],
+            "thoughts": answer.get("thoughts") or "",
+            "outcome": outcome[:OUTCOME_MAX_CHARS],
+        }
+        vector = self._vector(self.text(entry))
+        with self.lock:
+            folded = self._add(entry, vector)
+            if self.file is not None:
+                self.file.write(self._line(entry))
+                self.file.flush()
+                self.file_entries += 1
+                if self.file_entries > MEMORY_COMPACT_RATIO * self.max_entries:
+                    self._compact()
+                elif folded:
+                    self._save_summary()
+
+    def summary_text(self):
+        summary = self.summary
+        if not summary["decisions"]:
+            return ""
+        actions = ", ".join(f"{name} x{total['count']}" + (f" ({total['total']:g} total)" if total["total"] else "")
+                            for name, total in sorted(summary["actions"].items(),
+                                                      key=lambda item: -item[1]["count"]))
+        return (f"Earlier, from {summary['since']} to {summary.get('until_datetime')}: "
+                f"{summary['decisions']} decisions; actions: {actions}; goals: {'; '.join(summary['goals'])}")
+
+    def recall(self, query, top_k=MEMORY_TOP_K, recent=MEMORY_RECENT, max_tokens=MEMORY_PROMPT_TOKENS):
+        """
+        Memories for a prompt: the summary, the most recent ones and the most similar
+        to the query, within a token budget.
+
+        Args:
+            query (str): the current situation, e.g. goal and sensors
+            top_k (int): memories retrieved by similarity
+            recent (int): latest memories always included if they fit
+            max_tokens (int): estimated tokens of the text returned
+
+        Returns:
+            tuple: (text for the prompt, memories included)
+        """
+        vector = self._vector(query)
+        with self.lock:
+            entries = list(self.entries)
+            candidates = entries[::-1][:recent]
+            if entries and top_k:
+                rows = np.array([entry["row"] for entry in entries])
+                scores = self.vectors[rows] @ vector
+                k = min(top_k + recent, len(entries))
+                best = np.argpartition(-scores, k - 1)[:k]
+                chosen = {id(entry) for entry in candidates}
+                for index in best[np.argsort(-scores[best])]:
+                    if len(candidates) >= top_k + recent:
+                        break
+                    if id(entries[index]) not in chosen:
+                        candidates.append(entries[index])
+                        chosen.add(id(entries[index]))
+            summary = self.summary_text()
+
+        # Summary first, then the candidates in order of priority while they fit
+        lines = []
+        used = 0
+        if summary and estimate_tokens(summary) <= max_tokens:
+            lines.append(summary)
+            used += estimate_tokens(summary) + 1
+        included = []
+        for entry in candidates:
+            text = self.text(entry)
+            if used + estimate_tokens(text) + 1 > max_tokens:
+                continue
+            included.append(entry)
+            used += estimate_tokens(text) + 1
+        # Shown in time order
+        lines += [self.text(entry) for entry in sorted(included, key=lambda entry: entry["time"])]
+        return "\n".join(lines), len(included)
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,301 @@
+#!/usr/bin/python
+# Minimal Prometheus metrics for the servers, cheap enough to leave always on.
+#
+# Every thread updates its own shard of each metric, so the request path takes no
+# lock: a shard is a plain dict only written by its thread, and a scrape adds up
+# copies of all of them. When a thread exits its shard is folded into the totals of
+# the threads gone, so the shards do not grow with the threads started (the
+# development server starts one per request). Each worker process also dumps its
+# totals to METRICS_DIR so /metrics, served by any worker, reports the sum of all
+# the workers. Processes
+# without HTTP server publish gauges in the same directory with write_textfile().
+import glob
+import json
+import os
+import threading
+import time
+import weakref
+from state import STATE_DIR
+
+METRICS_DIR = os.path.join(STATE_DIR, "metrics")
+METRICS_DUMP_INTERVAL_SEC = 5
+# Dumps of workers that did not update them for this long are ignored
+METRICS_STALE_SEC = 60
+
+# Request latencies from 1 ms to 60 s (long polls)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labelnames, labels, extra=None):
+    pairs = list(zip(labelnames, labels)) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        # Shards of the running threads by key, inserted without lock (atomic under the GIL)
+        self._shards = {}
+        # Totals of the threads that exited, and the lock taken when a thread exits and
+        # by scrapes, never by updates
+        self._retired = {}
+        self._retired_lock = threading.Lock()
+
+    def _shard(self):
+        # Dict of the calling thread
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            # Released with the thread local storage when the thread exits
+            token = self._local.token = _ThreadToken()
+            self._shards[id(token)] = shard
+            weakref.finalize(token, self._retire, id(token))
+        return shard
+
+    def _retire(self, key):
+        with self._retired_lock:
+            shard = self._shards.pop(key, None)
+            if shard:
+                self._fold(self._retired, shard)
+
+    def _copies(self):
+        with self._retired_lock:
+            # dict() of a dict is atomic under the GIL
+            return [{labels: self._copy(value) for labels, value in shard.items()}
+                    for shard in [self._retired] + [dict(shard) for shard in list(self._shards.values())]]
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+class _ThreadToken:
+    # Something weakly referenceable kept in the thread local storage
+    pass
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, labels=(), value=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + value
+
+    def _fold(self, totals, shard):
+        for labels, value in shard.items():
+            totals[labels] = totals.get(labels, 0) + value
+
+    def totals(self):
+        totals = {}
+        for shard in self._copies():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def merge(self, totals, dumped):
+        for labels, value in dumped:
+            labels = tuple(labels)
+            totals[labels] = totals.get(labels, 0) + value
+
+    def samples(self, totals):
+        for labels, value in sorted(totals.items()):
+            yield self.name + _format_labels(self.labelnames, labels), value
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        shard = self._shard()
+        state = shard.get(labels)
+        if state is None:
+            # Counts per bucket (not cumulative), sum, count
+            state = shard[labels] = [[0] * len(self.buckets), 0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[0][index] += 1
+                break
+        state[1] += value
+        state[2] += 1
+
+    @staticmethod
+    def _copy(value):
+        # The state is updated in place by its thread
+        buckets, total, count = value
+        return [list(buckets), total, count]
+
+    def _fold(self, totals, shard):
+        for labels, (buckets, total, count) in shard.items():
+            self._add(totals, labels, list(buckets), total, count)
+
+    def totals(self):
+        totals = {}
+        for shard in self._copies():
+            for labels, (buckets, total, count) in shard.items():
+                self._add(totals, labels, list(buckets), total, count)
+        return totals
+
+    def _add(self, totals, labels, buckets, total, count):
+        current = totals.get(labels)
+        if current is None:
+            totals[labels] = [buckets, total, count]
+        else:
+            current[0] = [a + b for a, b in zip(current[0], buckets)]
+            current[1] += total
+            current[2] += count
+
+    def merge(self, totals, dumped):
+        for labels, (buckets, total, count) in dumped:
+            self._add(totals, tuple(labels), buckets, total, count)
+
+    def samples(self, totals):
+        for labels, (buckets, total, count) in sorted(totals.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, buckets):
+                cumulative += bucket
+                yield self.name + "_bucket" + _format_labels(self.labelnames, labels, ("le", bound)), cumulative
+            yield self.name + "_bucket" + _format_labels(self.labelnames, labels, ("le", "+Inf")), count
+            yield self.name + "_sum" + _format_labels(self.labelnames, labels), total
+            yield self.name + "_count" + _format_labels(self.labelnames, labels), count
+
+class Registry:
+    """
+    Metrics of a server process.
+
+    Args:
+        metrics_dir (str): where workers dump their totals, None to not share them
+    """
+
+    def __init__(self, metrics_dir=METRICS_DIR):
+        self.metrics = {}
+        self.gauges = []
+        self.metrics_dir = metrics_dir
+        self.dump_path = None
+        if metrics_dir is not None:
+            os.makedirs(metrics_dir, exist_ok=True)
+            self.dump_path = os.path.join(metrics_dir, f"{os.getpid()}.json")
+            thread = threading.Thread(target=self._dump_loop, name="metrics-dump", daemon=True)
+            thread.start()
+
+    def counter(self, name, help, labelnames=()):
+        self.metrics[name] = Counter(name, help, labelnames)
+        return self.metrics[name]
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.metrics[name] = Histogram(name, help, labelnames, buckets)
+        return self.metrics[name]
+
+    def gauge(self, name, help, function, labelnames=()):
+        # Computed on every scrape, function returns the value or None to skip it. With
+        # labelnames it returns a dict of label values tuple -> value instead.
+        self.gauges.append((name, help, function, tuple(labelnames)))
+
+    def _dump_loop(self):
+        while True:
+            time.sleep(METRICS_DUMP_INTERVAL_SEC)
+            self.dump()
+
+    def dump(self):
+        data = {name: list(metric.totals().items()) for name, metric in self.metrics.items()}
+        tmp_path = self.dump_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.dump_path)
+
+    def _other_workers(self):
+        # Dumps of the other worker processes that are still alive
+        if self.metrics_dir is None:
+            return []
+        dumps = []
+        now = time.time()
+        for path in glob.glob(os.path.join(self.metrics_dir, "*.json")):
+            if path == self.dump_path:
+                continue
+            try:
+                if now - os.stat(path).st_mtime > METRICS_STALE_SEC:
+                    os.remove(path)
+                    continue
+                with open(path) as f:
+                    dumps.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return dumps
+
+    def _textfiles(self):
+        # Metrics written by other containers with write_textfile()
+        if self.metrics_dir is None:
+            return ""
+        text = ""
+        for path in sorted(glob.glob(os.path.join(self.metrics_dir, "*.prom"))):
+            try:
+                with open(path) as f:
+                    text += f.read()
+            except OSError:
+                continue
+        return text
+
+    def render(self):
+        # Metrics in the Prometheus text exposition format
+
+        others = self._other_workers()
+        lines = []
+        for name, metric in self.metrics.items():
+            totals = metric.totals()
+            for dump in others:
+                metric.merge(totals, dump.get(name, []))
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            lines.extend(f"{sample} {value}" for sample, value in metric.samples(totals))
+
+        for name, help, function, labelnames in self.gauges:
+            try:
+                values = function()
+            except Exception as e:
+                print(f"Error computing metric {name}: {e}", flush=True)
+                continue
+            if not labelnames:
+                values = {(): values}
+            values = {labels: value for labels, value in (values or {}).items() if value is not None}
+            if not values:
+                continue
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(f"{name}{_format_labels(labelnames, labels)} {value}"
+                         for labels, value in sorted(values.items()))
+
+        return "\n".join(lines) + "\n" + self._textfiles()
+
+def write_textfile(name, samples, metrics_dir=METRICS_DIR):
+    """
+    Publish metrics of a process without HTTP server (e.g. image.py) in /metrics.
+
+    Args:
+        name (str): file name, one per process
+        samples (list): (metric name, type, help, value) tuples, values None are skipped.
+                        The name can have labels, e.g. 'frames_total{camera="front"}'
+    """
+    # Samples of the same metric together, after a single HELP and TYPE
+    metrics = {}
+    for metric, type, help, value in samples:
+        if value is None:
+            continue
+        family = metric.split("{", 1)[0]
+        if family not in metrics:
+            metrics[family] = [f"# HELP {family} {help}", f"# TYPE {family} {type}"]
+        metrics[family].append(f"{metric} {value}")
+    lines = [line for metric_lines in metrics.values() for line in metric_lines]
+
+    os.makedirs(metrics_dir, exist_ok=True)
+    path = os.path.join(metrics_dir, name + ".prom")
+    with open(path + ".tmp", "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(path + ".tmp", path)
@@ -0,0 +1,126 @@
+#!/usr/bin/python
+# Mosaic of several frames in a single image for the LLM, as the README describes: one
+# tile per camera or the last frames of a camera.
+#
+# The canvas is allocated once and each new frame is resized straight into its tile,
+# so an update costs one small resize and not a new composition. The JPEG of the
+# mosaic is encoded after each update and kept, the LLM gets it without any work.
+import math
+import os
+import threading
+from datetime import datetime, timezone
+import cv2
+import numpy as np
+
+# "cameras": one tile per camera, "recent": the last MOSAIC_FRAMES frames of the
+# default camera, empty to not build a mosaic
+MOSAIC = os.environ.get("MOSAIC", "")
+MOSAIC_FRAMES = int(os.environ.get("MOSAIC_FRAMES", 4))
+# Size of the whole mosaic, gemma3 sees images at 896x896
+MOSAIC_WIDTH = int(os.environ.get("MOSAIC_WIDTH", 896))
+MOSAIC_HEIGHT = int(os.environ.get("MOSAIC_HEIGHT", 896))
+MOSAIC_JPEG_QUALITY = 90
+
+class Mosaic:
+    """
+    Grid of tiles updated one at a time.
+
+    Args:
+        tiles (int): number of tiles, the grid is as square as possible
+        width (int): width of the mosaic in pixels
+        height (int): height of the mosaic in pixels
+    """
+
+    def __init__(self, tiles, width=MOSAIC_WIDTH, height=MOSAIC_HEIGHT):
+        self.tiles = tiles
+        self.columns = math.ceil(math.sqrt(tiles))
+        self.rows = math.ceil(tiles / self.columns)
+        self.tile_width = width // self.columns
+        self.tile_height = height // self.rows
+        self.canvas = np.zeros((height, width, 3), dtype=np.uint8)
+        self.lock = threading.Lock()
+        self.jpeg = None
+        self.updated = None
+        # Frame size -> (x, y, width, height) of the resized frame inside its tile
+        self.fits = {}
+
+    def _fit(self, shape):
+        # Keep the aspect ratio of the frame, centered in the tile
+        fit = self.fits.get(shape)
+        if fit is None:
+            scale = min(self.tile_width / shape[1], self.tile_height / shape[0])
+            width, height = max(int(shape[1] * scale), 1), max(int(shape[0] * scale), 1)
+            fit = self.fits[shape] = ((self.tile_width - width) // 2, (self.tile_height - height) // 2,
+                                      width, height)
+        return fit
+
+    def update(self, tile, frame, timestamp, label=""):
+        """
+        Replace a tile and encode the mosaic again.
+
+        Args:
+            tile (int): tile index, row by row from the top left corner
+            frame (numpy.ndarray): BGR frame of any size
+            timestamp (float): epoch seconds of the frame, written on the tile
+            label (str): written on the tile before the time, e.g. the camera name
+        """
+        row, column = divmod(tile % self.tiles, self.columns)
+        top, left = row * self.tile_height, column * self.tile_width
+        view = self.canvas[top:top + self.tile_height, left:left + self.tile_width]
+        x, y, width, height = self._fit(frame.shape[:2])
+
+        with self.lock:
+            if width != self.tile_width or height != self.tile_height:
+                view[:] = 0
+            # Resized in place, no intermediate image
+            cv2.resize(frame, (width, height), dst=view[y:y + height, x:x + width],
+                       interpolation=cv2.INTER_AREA)
+            text = f"{label} {datetime.fromtimestamp(timestamp, timezone.utc):%H:%M:%S}".strip()
+            cv2.putText(view, text, (4, self.tile_height - 6), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                        (255, 255, 255), 1, cv2.LINE_AA)
+            ok, jpeg = cv2.imencode(".jpg", self.canvas, [cv2.IMWRITE_JPEG_QUALITY, MOSAIC_JPEG_QUALITY])
+            self.jpeg = jpeg.tobytes()
+            # Cameras may deliver their frames out of order
+            self.updated = max(timestamp, self.updated or 0)
+
+    def latest(self):
+        # (JPEG bytes, epoch seconds of the last update), (None, None) before the first one
+        with self.lock:
+            return self.jpeg, self.updated
+
+class MosaicBuilder:
+    """
+    Feeds a Mosaic with the frames kept by the cameras of image.py.
+
+    Args:
+        mode (str): "cameras" or "recent", see MOSAIC
+        cameras (list): camera names, the first one is the default camera
+        frames (int): tiles in "recent" mode
+        on_update (function): called with (JPEG bytes, timestamp) after each update
+    """
+
+    def __init__(self, mode, cameras, frames=MOSAIC_FRAMES, on_update=None):
+        if mode not in ("cameras", "recent"):
+            raise ValueError(f"Unknown mosaic mode {mode}")
+        self.mode = mode
+        self.cameras = cameras
+        self.on_update = on_update
+        self.mosaic = Mosaic(len(cameras) if mode == "cameras" else frames)
+        self.count = 0
+        # Updates reach on_update in the same order they are made
+        self.lock = threading.Lock()
+
+    def add(self, camera, frame, timestamp):
+        # Frame kept by a camera, called from its thread
+        if self.mode == "cameras":
+            tile = self.cameras.index(camera)
+        elif camera == self.cameras[0]:
+            # The oldest tile is replaced, the time on each tile gives the order
+            tile = self.count
+            self.count += 1
+        else:
+            return
+        with self.lock:
+            self.mosaic.update(tile, frame, timestamp, label=camera)
+            if self.on_update is not None:
+                self.on_update(*self.mosaic.latest())
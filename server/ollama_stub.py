@@ -0,0 +1,168 @@
+#!/usr/bin/python
+# Local HTTP server answering like the ollama API, to run llm.py without a GPU and to
+# see the effect of keep-alive and of the stable system prompt on time to first token:
+#   - the first request, or one after keep_alive expired, waits --load-sec to "load"
+#   - a request with the same system prompt as the previous one evaluates only the
+#     rest of the messages, like ollama reusing its cache
+#   - the answer is a fixed decision, streamed word by word every --token-sec
+#
+#   python ollama_stub.py --port 11435
+#   OLLAMA_HOST=http://localhost:11435 python llm.py
+import argparse
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER = {
+    "steps": [{"turn_left": 30}, {"forward": 20}],
+    "goal": "Look for and push the ball.",
+    "thoughts": "The ball is not in view, turning to look for it.",
+    "description": "An empty floor in front of the robot.",
+}
+# Prompt tokens evaluated per second, roughly
+PROMPT_TOKENS_PER_SEC = 2000
+
+def keep_alive_seconds(value, default):
+    # "30m", "1h", "10s", seconds as a number, negative keeps it loaded forever
+    if value is None:
+        return default
+    if isinstance(value, (int, float)):
+        return float("inf") if value < 0 else float(value)
+    match = re.fullmatch(r"(-?[\d.]+)(ms|s|m|h)?", str(value).strip())
+    if not match:
+        return default
+    seconds = float(match.group(1)) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600, None: 1}[match.group(2)]
+    return float("inf") if seconds < 0 else seconds
+
+def tokens(text):
+    # Close enough for a stub, ~4 characters per token
+    return max(1, len(text) // 4)
+
+class StubModel:
+    """
+    Load state and prompt cache of the single model served.
+
+    Args:
+        load_sec (float): seconds to load the model
+        token_sec (float): seconds per generated token
+        keep_alive (float): seconds loaded after a request without keep_alive
+    """
+
+    def __init__(self, load_sec, token_sec, keep_alive):
+        self.load_sec = load_sec
+        self.token_sec = token_sec
+        self.keep_alive = keep_alive
+        self.lock = threading.Lock()
+        self.expires = None
+        self.cached_prefix = None
+
+    def prepare(self, messages, keep_alive):
+        """
+        Load the model if needed and evaluate the prompt, one request at a time.
+
+        Returns:
+            dict: load and prompt durations in nanoseconds and prompt tokens evaluated
+        """
+        with self.lock:
+            load = 0.0
+            if self.expires is None or time.monotonic() > self.expires:
+                time.sleep(self.load_sec)
+                load = self.load_sec
+                self.cached_prefix = None
+            prefix = messages[0]["content"] if messages and messages[0]["role"] == "system" else None
+            evaluated = messages
+            if prefix is not None and prefix == self.cached_prefix:
+                evaluated = messages[1:]
+            self.cached_prefix = prefix
+            count = sum(tokens(m.get("content", "")) + 256 * len(m.get("images") or []) for m in evaluated)
+            prompt = count / PROMPT_TOKENS_PER_SEC
+            time.sleep(prompt)
+            self.expires = time.monotonic() + keep_alive_seconds(keep_alive, self.keep_alive)
+            return {"load_duration": int(load * 1e9), "prompt_eval_count": count,
+                    "prompt_eval_duration": int(prompt * 1e9)}
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    model = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, body, status=200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/api/version":
+            self.send_json({"version": "0.0.0-stub"})
+        elif self.path == "/api/tags":
+            self.send_json({"models": [{"name": "gemma3:12b", "model": "gemma3:12b"}]})
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        if self.path != "/api/chat":
+            self.send_json({"error": "not found"}, 404)
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        start = time.perf_counter()
+        stats = self.model.prepare(request.get("messages", []), request.get("keep_alive"))
+
+        words = re.findall(r"\S+\s*", json.dumps(ANSWER, indent=1))
+        limit = (request.get("options") or {}).get("num_predict")
+        if limit is not None and limit >= 0:
+            words = words[:limit]
+        model = request.get("model", "gemma3:12b")
+
+        def chunk(content, done, **extra):
+            return {"model": model, "created_at": datetime.now(timezone.utc).isoformat(),
+                    "message": {"role": "assistant", "content": content}, "done": done, **extra}
+
+        if not request.get("stream", True):
+            time.sleep(self.model.token_sec * len(words))
+            final = self.final_stats(stats, len(words), start)
+            self.send_json(chunk("".join(words), True, **final))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for word in words:
+            time.sleep(self.model.token_sec)
+            self.write_chunk(chunk(word, False))
+        self.write_chunk(chunk("", True, **self.final_stats(stats, len(words), start)))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def final_stats(self, stats, count, start):
+        return {"done_reason": "stop", "total_duration": int((time.perf_counter() - start) * 1e9),
+                "eval_count": count, "eval_duration": int(count * self.model.token_sec * 1e9), **stats}
+
+    def write_chunk(self, body):
+        data = json.dumps(body).encode() + b"\n"
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--load-sec", type=float, default=3.0)
+    parser.add_argument("--token-sec", type=float, default=0.02)
+    parser.add_argument("--keep-alive-sec", type=float, default=300.0,
+                        help="seconds loaded when a request has no keep_alive")
+    args = parser.parse_args()
+
+    Handler.model = StubModel(args.load_sec, args.token_sec, args.keep_alive_sec)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), Handler)
+    print(f"ollama stub on http://127.0.0.1:{args.port}", flush=True)
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# Periodic ticks on a fixed grid of the monotonic clock, so the capture loops neither
+# drift nor wake up more than once per tick.
+import math
+import os
+import time
+
+# What to do with the ticks missed when a tick runs late (e.g. a slow read or encode):
+#   skip   run once now and continue on the grid, the missed ticks are counted
+#   burst  run the missed ticks back to back, at most MAX_BURST_TICKS of them
+CATCH_UP = os.environ.get("CAPTURE_CATCH_UP", "skip")
+MAX_BURST_TICKS = 10
+
+class Ticker:
+    """
+    Sleeps until the next tick of a fixed interval.
+
+    Args:
+        interval (float): seconds between ticks, can be below one
+        catch_up (str): "skip" or "burst", see CATCH_UP
+    """
+
+    def __init__(self, interval, catch_up=CATCH_UP):
+        if catch_up not in ("skip", "burst"):
+            raise ValueError(f"Unknown catch up policy {catch_up}")
+        self.interval = interval
+        self.catch_up = catch_up
+        self.next_tick = time.monotonic()
+        self.ticks = 0
+        self.skipped = 0
+        # Seconds between each tick and when wait() returned, since the last stats()
+        self.jitter_sum = 0.0
+        self.jitter_max = 0.0
+        self.jitter_count = 0
+
+    def wait(self):
+        # Block until the next tick, a single sleep
+        now = time.monotonic()
+        if now < self.next_tick:
+            time.sleep(self.next_tick - now)
+            now = time.monotonic()
+        else:
+            missed = math.floor((now - self.next_tick) / self.interval)
+            if self.catch_up == "burst":
+                missed = max(missed - MAX_BURST_TICKS, 0)
+            if missed:
+                self.skipped += missed
+                self.next_tick += missed * self.interval
+
+        jitter = now - self.next_tick
+        self.jitter_sum += jitter
+        self.jitter_max = max(self.jitter_max, jitter)
+        self.jitter_count += 1
+        self.ticks += 1
+        self.next_tick += self.interval
+
+    def stats(self):
+        """
+        Timing of the ticks since the previous call.
+
+        Returns:
+            dict: "jitter_mean" and "jitter_max" in seconds (None without ticks),
+                  "ticks" and "skipped" since the start
+        """
+        count = self.jitter_count
+        stats = {
+            "jitter_mean": self.jitter_sum / count if count else None,
+            "jitter_max": self.jitter_max if count else None,
+            "ticks": self.ticks,
+            "skipped": self.skipped,
+        }
+        self.jitter_sum, self.jitter_max, self.jitter_count = 0.0, 0.0, 0
+        return stats
@@ -1,12 +1,43 @@
 #!/usr/bin/python
-from flask import Flask, request, jsonify
-import os
-import yaml
 import json
+import os
+import threading
+import time
+from flask import Flask, Response, request, jsonify
+from eventlog import SegmentedEventLog, GroupCommitWriter
+from ingest import (EVENTS_DIR, HISTORY_SNAPSHOT_FILE, INSTRUCTIONS_DIR, STREAM_KEEPALIVE_SEC,
+                    InstructionsWatcher, ServerMetrics, is_binary, parse_readings, publish_readings,
+                    robot_id, wait_seconds)
+from instructions import InstructionQueue
+from state import SharedState
+from timeseries import HistorySnapshotter, SensorHistory
 
+# Development server. Production runs sensors_asgi.py with the same routes.
 app = Flask(__name__)
 
-EVENTS_FILE="/usr/local/src/data/event.log"
+# Batches writes of all requests (see GroupCommitWriter for durability settings)
+events_writer = None
+# Plans published by llm.py
+instruction_queue = None
+# Served on /metrics
+server_metrics = None
+# Latest reading and sensors history for llm.py
+shared_state = None
+history = None
+# Notified by the InstructionsWatcher when llm.py publishes instructions
+instructions_changed = threading.Condition()
+
+@app.before_request
+def start_timer():
+    request.start_time = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    server_metrics.observe_request(request.endpoint or "unknown",
+                                   robot_id(request.headers),
+                                   time.perf_counter() - request.start_time)
+    return response
+
 @app.route('/sensors', methods=['POST'])
 def sensors():
     # Get sensors data from the POST request
@@ -16,30 +47,92 @@ def sensors():
     # - battery level
     # - distance in centimeters
     # - collision bumpers state (left, front o right)
-    with open(EVENTS_FILE, 'a') as file:
-        data = request.get_json()
-        print(data, flush=True)
-        json_line = json.dumps(data) + "\n"
-        file.write(json_line)
-        return'{"ok"}', 200
+    # Sent as JSON or as a binary record (see wire.py), stored as JSON
+    content_type = request.content_type if is_binary(request.content_type) else "application/json"
+    try:
+        readings = parse_readings(request.get_data(), content_type)
+    except ValueError as e:
+        return jsonify(error=f"Invalid readings: {e}"), 400
+    print(readings[-1], flush=True)
+    events_writer.commit(readings)
+    publish_readings(shared_state, history, readings)
+    return'{"ok"}', 200
+
+@app.route('/sensors/batch', methods=['POST'])
+def sensors_batch():
+    # Several readings in one request, written in a single commit
+    try:
+        readings = parse_readings(request.get_data(), request.content_type)
+    except ValueError as e:
+        return jsonify(error=f"Invalid readings: {e}"), 400
 
-# Path of file instructions.yaml
-file_path = "/usr/local/src/data/instructions.yaml"
+    print(f"{len(readings)} readings received", flush=True)
+    events_writer.commit(readings)
+    publish_readings(shared_state, history, readings)
+    return jsonify(ok=True, count=len(readings)), 200
+
+def notify_instructions():
+    with instructions_changed:
+        instructions_changed.notify_all()
+
+def wait_instructions(timeout):
+    # Take the next plan, waiting up to timeout seconds for llm.py to publish one
+    deadline = time.monotonic() + timeout
+    with instructions_changed:
+        instructions = instruction_queue.consume()
+        while instructions is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            instructions_changed.wait(remaining)
+            instructions = instruction_queue.consume()
+    return instructions
 
 @app.route('/instructions', methods=['GET'])
 def return_instructions():
-    if os.path.exists(file_path):
-        # Convert to json and send
-        with open(file_path, 'r') as file:
-            yaml_content = yaml.safe_load(file)
+    # Long poll with ?wait=<seconds>
+    instructions = wait_instructions(wait_seconds(request.args.get("wait")))
+    if instructions is not None:
+        return instructions
+    else:
+        return jsonify(error="No pending instructions"), 404
 
-        os.remove(file_path)
-        return yaml_content
+@app.route('/instructions/<int:plan_id>/ack', methods=['POST'])
+def ack_instructions(plan_id):
+    # The robot executed the plan
+    if instruction_queue.ack(plan_id):
+        return jsonify(ok=True), 200
     else:
-        return jsonify(error="File instructions.yaml does not exist"), 404
+        return jsonify(error=f"Plan {plan_id} is not waiting for an acknowledgement"), 404
+
+@app.route('/instructions/stream', methods=['GET'])
+def stream_instructions():
+    # Server-sent events: one "data:" message per plan
+    def events():
+        while True:
+            instructions = wait_instructions(STREAM_KEEPALIVE_SEC)
+            if instructions is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"data: {json.dumps(instructions)}\n\n"
+
+    return Response(events(), mimetype="text/event-stream")
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # Prometheus text format
+    return Response(server_metrics.render(), mimetype="text/plain; version=0.0.4")
 
 if __name__ == '__main__':
-    # Create directory if not exists
-    os.makedirs(os.path.dirname(EVENTS_FILE), exist_ok=True)
+    instruction_queue = InstructionQueue(INSTRUCTIONS_DIR)
+    shared_state = SharedState()
+    server_metrics = ServerMetrics(instruction_queue, shared_state)
+    # Creates the directory if not exists and keeps the current segment open
+    events_writer = GroupCommitWriter(SegmentedEventLog(EVENTS_DIR),
+                                      on_commit=server_metrics.observe_commit)
+    history = SensorHistory()
+    # Restores the history after a pod restart and saves it periodically
+    HistorySnapshotter(history, HISTORY_SNAPSHOT_FILE)
+    InstructionsWatcher(notify_instructions)
 
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    app.run(host='0.0.0.0', port=int(os.environ.get("PORT", 5000)), debug=True)
@@ -0,0 +1,176 @@
+#!/usr/bin/python
+# Production server for the robot: same routes as sensors.py on an ASGI stack.
+# Run with: python sensors_asgi.py (SERVER_WORKERS processes listening on PORT)
+import asyncio
+import contextlib
+import json
+import os
+import time
+import uvicorn
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.middleware import Middleware
+from starlette.routing import Route
+from eventlog import SegmentedEventLog, GroupCommitWriter
+from ingest import (EVENTS_DIR, HISTORY_SNAPSHOT_FILE, INSTRUCTIONS_DIR, STREAM_KEEPALIVE_SEC,
+                    InstructionsWatcher, ServerMetrics, is_binary, parse_readings, publish_readings,
+                    robot_id, wait_seconds)
+from instructions import InstructionQueue
+from state import SharedState
+from timeseries import HistorySnapshotter, SensorHistory
+
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", 2))
+PORT = int(os.environ.get("PORT", 5000))
+
+# One writer per worker process, created on startup
+events_writer = None
+# Plans published by llm.py
+instruction_queue = None
+# Served on /metrics
+server_metrics = None
+# Latest reading and sensors history for llm.py
+shared_state = None
+history = None
+# Set and replaced by a new one every time llm.py publishes instructions
+instructions_changed = None
+
+async def commit(readings):
+    # The writer thread does the file I/O. Only wait for it when the durability
+    # requires the fsync, without blocking the event loop.
+    future = events_writer.submit(readings)
+    if events_writer.durability == "fsync":
+        await asyncio.wrap_future(future)
+    # Memory write, cheap enough to do in the event loop
+    publish_readings(shared_state, history, readings)
+
+async def sensors(request):
+    # Sent as JSON or as a binary record (see wire.py), stored as JSON
+    content_type = request.headers.get("content-type")
+    if not is_binary(content_type):
+        content_type = "application/json"
+    try:
+        readings = parse_readings(await request.body(), content_type)
+    except ValueError as e:
+        return JSONResponse({"error": f"Invalid readings: {e}"}, status_code=400)
+    await commit(readings)
+    return Response('{"ok"}', media_type="text/html")
+
+async def sensors_batch(request):
+    try:
+        readings = parse_readings(await request.body(), request.headers.get("content-type"))
+    except ValueError as e:
+        return JSONResponse({"error": f"Invalid readings: {e}"}, status_code=400)
+    await commit(readings)
+    return JSONResponse({"ok": True, "count": len(readings)})
+
+def wake_instructions_waiters():
+    global instructions_changed
+    instructions_changed.set()
+    instructions_changed = asyncio.Event()
+
+async def wait_instructions(timeout):
+    # Take the next plan, waiting up to timeout seconds for llm.py to publish one
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        # Take the event before popping so a publish in between is not missed
+        changed = instructions_changed
+        instructions = await run_in_threadpool(instruction_queue.consume)
+        remaining = deadline - loop.time()
+        if instructions is not None or remaining <= 0:
+            return instructions
+        try:
+            await asyncio.wait_for(changed.wait(), remaining)
+        except asyncio.TimeoutError:
+            pass
+
+async def return_instructions(request):
+    # Long poll with ?wait=<seconds>
+    instructions = await wait_instructions(wait_seconds(request.query_params.get("wait")))
+    if instructions is not None:
+        return JSONResponse(instructions)
+    else:
+        return JSONResponse({"error": "No pending instructions"}, status_code=404)
+
+async def ack_instructions(request):
+    # The robot executed the plan
+    plan_id = request.path_params["plan_id"]
+    if await run_in_threadpool(instruction_queue.ack, plan_id):
+        return JSONResponse({"ok": True})
+    else:
+        return JSONResponse({"error": f"Plan {plan_id} is not waiting for an acknowledgement"},
+                            status_code=404)
+
+async def stream_instructions(request):
+    # Server-sent events: one "data:" message per plan
+    async def events():
+        while True:
+            instructions = await wait_instructions(STREAM_KEEPALIVE_SEC)
+            if instructions is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"data: {json.dumps(instructions)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+async def metrics(request):
+    # Prometheus text format
+    return PlainTextResponse(await run_in_threadpool(server_metrics.render),
+                             media_type="text/plain; version=0.0.4")
+
+class MetricsMiddleware:
+    # Latency and count of every request, labelled by route (endpoint name) and robot
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            # The router adds the endpoint to the scope
+            endpoint = scope.get("endpoint")
+            headers = {"X-Robot-Id": dict(scope["headers"]).get(b"x-robot-id", b"").decode("latin-1")}
+            server_metrics.observe_request(endpoint.__name__ if endpoint else "unknown",
+                                           robot_id(headers),
+                                           time.perf_counter() - start)
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    global events_writer, instruction_queue, server_metrics, shared_state, history, instructions_changed
+    instruction_queue = InstructionQueue(INSTRUCTIONS_DIR)
+    shared_state = SharedState()
+    server_metrics = ServerMetrics(instruction_queue, shared_state)
+    events_writer = GroupCommitWriter(SegmentedEventLog(EVENTS_DIR),
+                                      on_commit=server_metrics.observe_commit)
+    history = SensorHistory()
+    # Restores the history after a pod restart and saves it periodically
+    snapshotter = HistorySnapshotter(history, HISTORY_SNAPSHOT_FILE)
+    instructions_changed = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    InstructionsWatcher(lambda: loop.call_soon_threadsafe(wake_instructions_waiters))
+    yield
+    events_writer.close()
+    snapshotter.snapshot(force=True)
+    shared_state.close()
+
+app = Starlette(
+    routes=[
+        Route('/sensors', sensors, methods=['POST']),
+        Route('/sensors/batch', sensors_batch, methods=['POST']),
+        Route('/instructions', return_instructions, methods=['GET']),
+        Route('/instructions/stream', stream_instructions, methods=['GET']),
+        Route('/instructions/{plan_id:int}/ack', ack_instructions, methods=['POST']),
+        Route('/metrics', metrics, methods=['GET']),
+    ],
+    middleware=[Middleware(MetricsMiddleware)],
+    lifespan=lifespan,
+)
+
+if __name__ == '__main__':
+    uvicorn.run("sensors_asgi:app", host='0.0.0.0', port=PORT, workers=SERVER_WORKERS,
+                log_level="warning")
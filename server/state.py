@@ -0,0 +1,214 @@
+#!/usr/bin/python
+# Latest state shared by the containers of the pod through a memory mapped file.
+#
+# sensors.py and image.py update their slot in place and llm.py reads the current
+# state without touching the PVC. The file lives in STATE_DIR, an emptyDir in memory
+# mounted in all the containers (see helm/templates/statefulset.yaml).
+#
+# Each slot is protected by a sequence lock: the writer makes the slot sequence odd,
+# writes and makes it even again, so readers retry instead of reading half a record.
+# Readers block on a FIFO until a writer notifies a change.
+import errno
+import fcntl
+import json
+import mmap
+import os
+import select
+import struct
+import threading
+import time
+
+STATE_DIR = os.environ.get("VIKARE_STATE_DIR", "/usr/local/src/shm")
+STATE_FILE = "state"
+NOTIFY_DIR = "notify"
+# lockf() locks belong to the process, so threads of a process writing at the same time
+# (e.g. requests of the threaded development server) also take this one
+_write_lock = threading.Lock()
+
+MAGIC = b"VKST"
+LAYOUT_VERSION = 3
+HEADER = struct.Struct("<4sI")
+# sequence, timestamp, payload length
+SLOT_HEADER = struct.Struct("<QdI")
+
+# Slot name -> maximum payload size. Payloads are JSON.
+SLOTS = {
+    "sensors": 4096,
+    # Latest frame of each camera
+    "frame": 2048,
+    # Written by llm.py when it publishes new instructions
+    "instructions": 256,
+}
+
+def _layout():
+    offsets = {}
+    offset = HEADER.size
+    for name, size in SLOTS.items():
+        offsets[name] = (offset, size)
+        offset += SLOT_HEADER.size + size
+    return offsets, offset
+
+SLOT_OFFSETS, STATE_SIZE = _layout()
+
+class SharedState:
+    """
+    Memory mapped latest state.
+
+    Args:
+        state_dir (str): directory shared by the containers
+        subscriber (str): name of this reader, needed to wait() for changes
+    """
+
+    def __init__(self, state_dir=STATE_DIR, subscriber=None):
+        self.state_dir = state_dir
+        self.notify_dir = os.path.join(state_dir, NOTIFY_DIR)
+        os.makedirs(self.notify_dir, exist_ok=True)
+
+        self.fd = os.open(os.path.join(state_dir, STATE_FILE), os.O_RDWR | os.O_CREAT, 0o666)
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, HEADER.size, 0)
+        try:
+            if os.fstat(self.fd).st_size < STATE_SIZE:
+                os.ftruncate(self.fd, STATE_SIZE)
+            self.map = mmap.mmap(self.fd, STATE_SIZE)
+            if HEADER.unpack_from(self.map, 0) != (MAGIC, LAYOUT_VERSION):
+                # New file or written by an older layout
+                self.map[:STATE_SIZE] = bytes(STATE_SIZE)
+                HEADER.pack_into(self.map, 0, MAGIC, LAYOUT_VERSION)
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, HEADER.size, 0)
+
+        self.fifo = None
+        self.fifo_path = None
+        if subscriber is not None:
+            self._subscribe(subscriber)
+
+    def _subscribe(self, name):
+        self.fifo_path = os.path.join(self.notify_dir, name)
+        try:
+            os.mkfifo(self.fifo_path)
+        except FileExistsError:
+            pass
+        # Open for writing too so select() does not see EOF when no writer is connected
+        self.fifo = os.open(self.fifo_path, os.O_RDWR | os.O_NONBLOCK)
+
+    def _notify(self):
+        for name in os.listdir(self.notify_dir):
+            try:
+                fd = os.open(os.path.join(self.notify_dir, name), os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as e:
+                # ENXIO: nobody is listening on it
+                if e.errno not in (errno.ENXIO, errno.ENOENT):
+                    raise
+                continue
+            try:
+                os.write(fd, b"\0")
+            except BlockingIOError:
+                # Pipe full: the reader has pending notifications anyway
+                pass
+            finally:
+                os.close(fd)
+
+    def write(self, slot, value, timestamp=None):
+        """
+        Replace the value of a slot and wake up the subscribers.
+
+        Args:
+            slot (str): one of SLOTS
+            value: JSON serializable value
+            timestamp (float): epoch seconds of the value, defaults to now
+        """
+        offset, size = SLOT_OFFSETS[slot]
+        payload = json.dumps(value).encode("utf-8")
+        if len(payload) > size:
+            raise ValueError(f"{slot} value is {len(payload)} bytes, maximum is {size}")
+        if timestamp is None:
+            timestamp = time.time()
+
+        # Only one writer per slot (e.g. several server workers)
+        with _write_lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, SLOT_HEADER.size + size, offset)
+            try:
+                sequence = SLOT_HEADER.unpack_from(self.map, offset)[0]
+                # Odd if a previous writer died in the middle of a write
+                sequence += sequence % 2
+                SLOT_HEADER.pack_into(self.map, offset, sequence + 1, timestamp, len(payload))
+                start = offset + SLOT_HEADER.size
+                self.map[start:start + len(payload)] = payload
+                SLOT_HEADER.pack_into(self.map, offset, sequence + 2, timestamp, len(payload))
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, SLOT_HEADER.size + size, offset)
+
+        self._notify()
+
+    def read(self, slot):
+        """
+        Read the value of a slot.
+
+        Returns:
+            tuple: (value, timestamp), (None, None) if it was never written
+        """
+        offset, size = SLOT_OFFSETS[slot]
+        while True:
+            sequence, timestamp, length = SLOT_HEADER.unpack_from(self.map, offset)
+            if sequence % 2:
+                # Being written right now
+                time.sleep(0)
+                continue
+            start = offset + SLOT_HEADER.size
+            payload = self.map[start:start + length]
+            if SLOT_HEADER.unpack_from(self.map, offset)[0] == sequence:
+                break
+
+        if sequence == 0:
+            return None, None
+        return json.loads(payload), timestamp
+
+    def sequence(self, slots=None):
+        # Number of updates of the slots (all by default). Changes every time one is written.
+        if slots is None:
+            slots = SLOTS
+        return sum(SLOT_HEADER.unpack_from(self.map, SLOT_OFFSETS[slot][0])[0] // 2
+                   for slot in slots)
+
+    def wait(self, sequence, timeout=None, slots=None):
+        """
+        Block until the sequence is different from the given one.
+
+        Args:
+            sequence (int): last sequence seen by the caller
+            timeout (float): seconds to wait at most, None waits forever
+            slots (list): slots to watch, all by default
+
+        Returns:
+            int: current sequence, equal to the given one on timeout
+        """
+        if self.fifo is None:
+            raise RuntimeError("wait() needs a subscriber name")
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            current = self.sequence(slots)
+            if current != sequence:
+                return current
+
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return current
+            readable, _, _ = select.select([self.fifo], [], [], remaining)
+            if readable:
+                try:
+                    # Drain every pending notification
+                    while os.read(self.fifo, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+
+    def close(self):
+        self.map.close()
+        os.close(self.fd)
+        if self.fifo is not None:
+            os.close(self.fifo)
+            try:
+                os.remove(self.fifo_path)
+            except FileNotFoundError:
+                pass
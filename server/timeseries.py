@@ -0,0 +1,284 @@
+#!/usr/bin/python
+# Sensors history as typed columns, for queries like "compass of the last 30 seconds"
+# without parsing the event log.
+#
+# The columns are a ring of HISTORY_CAPACITY readings in a memory mapped file in
+# STATE_DIR (see state.py), so every server worker appends to the same history and
+# llm.py reads it directly. Times are sorted, so a time range is a binary search on
+# the (at most two) sorted halves of the ring.
+#
+# STATE_DIR is in memory and lost when the pod restarts: the servers snapshot the
+# history to the PVC every HISTORY_SNAPSHOT_INTERVAL_SEC and restore it on startup.
+import fcntl
+import os
+import threading
+import time
+import numpy as np
+from state import STATE_DIR
+
+HISTORY_FILE = "history"
+HISTORY_CAPACITY = int(os.environ.get("HISTORY_CAPACITY", 131072))
+HISTORY_SNAPSHOT_INTERVAL_SEC = float(os.environ.get("HISTORY_SNAPSHOT_INTERVAL_SEC", 300))
+
+# Column -> type. time is the epoch seconds when the server received the reading.
+COLUMNS = {
+    "time": np.float64,
+    "distance": np.float32,
+    "battery": np.float32,
+    "compass": np.float32,
+    "bumpers": np.uint8,
+    "cliff_left": np.int16,
+    "cliff_front_left": np.int16,
+    "cliff_front_right": np.int16,
+    "cliff_right": np.int16,
+}
+
+# Columns filled from the reading, see _row
+VALUE_COLUMNS = [name for name in COLUMNS if name != "time"]
+
+# Same codes as the binary wire format
+BUMPERS = {False: 0, "right": 1, "left": 2, "front": 3}
+BUMPERS_UNKNOWN = 255
+
+# lockf() locks belong to the process, threads of a process writing at the same
+# time (e.g. requests of the threaded development server) also take this one
+_write_lock = threading.Lock()
+
+# uint64 count of readings ever appended, float64 time of the last snapshot
+HEADER_SIZE = 64
+
+def _number(value, default=np.nan):
+    return default if value is None else float(value)
+
+def _row(reading):
+    # Typed values of a reading in the order of COLUMNS after time, raises ValueError or
+    # TypeError for a malformed reading before anything is written
+    cliff = reading.get("cliff") or {}
+    if not isinstance(cliff, dict):
+        raise TypeError(f"cliff must be an object, not {type(cliff).__name__}")
+    values = (
+        _number(reading.get("distance")),
+        _number(reading.get("battery")),
+        _number(reading.get("compass")),
+        BUMPERS.get(reading.get("bumpers"), BUMPERS_UNKNOWN),
+        int(_number(cliff.get("left"), -1)),
+        int(_number(cliff.get("front_left"), -1)),
+        int(_number(cliff.get("front_right"), -1)),
+        int(_number(cliff.get("right"), -1)),
+    )
+    try:
+        return tuple(COLUMNS[name](value) for name, value in zip(VALUE_COLUMNS, values))
+    except OverflowError as e:
+        raise ValueError(f"reading out of range: {e}")
+
+class SensorHistory:
+    """
+    Columnar ring of sensors readings shared by the processes of the pod.
+
+    Args:
+        state_dir (str): directory of the memory mapped file
+        capacity (int): readings kept, the oldest are overwritten
+    """
+
+    def __init__(self, state_dir=STATE_DIR, capacity=HISTORY_CAPACITY):
+        os.makedirs(state_dir, exist_ok=True)
+        self.capacity = capacity
+        path = os.path.join(state_dir, HISTORY_FILE)
+        size = HEADER_SIZE + capacity * sum(np.dtype(t).itemsize for t in COLUMNS.values())
+
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+        if os.fstat(self.fd).st_size != size:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX)
+            try:
+                # New file or different capacity: start empty
+                if os.fstat(self.fd).st_size != size:
+                    os.ftruncate(self.fd, 0)
+                    os.ftruncate(self.fd, size)
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN)
+
+        self.count = np.memmap(path, dtype=np.uint64, mode="r+", offset=0, shape=(1,))
+        self.snapshot_time = np.memmap(path, dtype=np.float64, mode="r+", offset=8, shape=(1,))
+        self.columns = {}
+        offset = HEADER_SIZE
+        for name, dtype in COLUMNS.items():
+            self.columns[name] = np.memmap(path, dtype=dtype, mode="r+", offset=offset, shape=(capacity,))
+            offset += capacity * np.dtype(dtype).itemsize
+
+    def __len__(self):
+        return min(int(self.count[0]), self.capacity)
+
+    def append(self, readings, timestamp=None):
+        """
+        Append readings as received by the servers.
+
+        Args:
+            readings (list): dicts with the shape of esp32/main.py:get_sensors_data
+            timestamp (float): epoch seconds when they were received, defaults to now
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        # All readings converted first, a bad one must not leave half a row in the ring
+        rows = [_row(reading) for reading in readings]
+
+        with _write_lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX)
+            try:
+                count = int(self.count[0])
+                if count:
+                    # Keep times sorted even if the clock goes backwards
+                    timestamp = max(timestamp, float(self.columns["time"][(count - 1) % self.capacity]))
+                for row in rows:
+                    index = count % self.capacity
+                    self.columns["time"][index] = timestamp
+                    for name, value in zip(VALUE_COLUMNS, row):
+                        self.columns[name][index] = value
+                    count += 1
+                # Readers only look at rows below count, so publish it last
+                self.count[0] = count
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN)
+
+    def _slices(self, count):
+        # Physical slices of the ring in time order
+        if count <= self.capacity:
+            return [(0, count)]
+        head = count % self.capacity
+        return [(head, self.capacity), (0, head)]
+
+    def range(self, start=None, end=None, fields=None):
+        """
+        Readings received between start and end (epoch seconds, both included).
+
+        Args:
+            start (float): None for the oldest one
+            end (float): None for the newest one
+            fields (list): columns to return, all by default
+
+        Returns:
+            dict: column name -> numpy array (a copy), oldest first
+        """
+        if fields is None:
+            fields = list(COLUMNS)
+        count = int(self.count[0])
+        times = self.columns["time"]
+
+        parts = []
+        # Index since the first reading ever of the first row returned
+        first_index = None
+        base = max(count - self.capacity, 0)
+        for lo, hi in self._slices(count):
+            first = lo if start is None else lo + int(np.searchsorted(times[lo:hi], start, side="left"))
+            last = hi if end is None else lo + int(np.searchsorted(times[lo:hi], end, side="right"))
+            if first < last:
+                if first_index is None:
+                    first_index = base + first - lo
+                parts.append((first, last))
+            base += hi - lo
+
+        result = {field: np.concatenate([self.columns[field][lo:hi] for lo, hi in parts])
+                  if parts else np.empty(0, dtype=COLUMNS[field]) for field in fields}
+
+        # Drop the oldest rows if a writer overwrote them while we were copying
+        if first_index is not None:
+            lost = int(self.count[0]) - self.capacity - first_index
+            if lost > 0:
+                result = {field: values[lost:] for field, values in result.items()}
+        return result
+
+    def last(self, field, seconds, now=None):
+        # Values of a column during the last seconds, e.g. last("compass", 30)
+        if now is None:
+            now = time.time()
+        return self.range(now - seconds, None, fields=[field])[field]
+
+    def aggregate(self, field, start=None, end=None):
+        """
+        Count, min, max and mean of a column in a time range, ignoring missing values.
+
+        Returns:
+            dict: {"count", "min", "max", "mean"}, values None if there are no readings
+        """
+        values = self.range(start, end, fields=[field])[field].astype(np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return {"count": 0, "min": None, "max": None, "mean": None}
+        return {
+            "count": len(values),
+            "min": float(values.min()),
+            "max": float(values.max()),
+            "mean": float(values.mean()),
+        }
+
+    def snapshot(self, path):
+        # Save the history in time order (npz) with an atomic rename
+        data = self.range()
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **data)
+        os.replace(tmp_path, path)
+        self.snapshot_time[0] = time.time()
+
+    def restore(self, path):
+        # Load a snapshot if the history is empty (e.g. the pod restarted)
+        if not os.path.exists(path):
+            return False
+
+        with _write_lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX)
+            try:
+                if int(self.count[0]):
+                    return False
+                with np.load(path) as data:
+                    rows = min(len(data["time"]), self.capacity)
+                    for name in COLUMNS:
+                        if name in data:
+                            self.columns[name][:rows] = data[name][-rows:]
+                self.count[0] = rows
+                self.snapshot_time[0] = time.time()
+                return True
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN)
+
+    def close(self):
+        os.close(self.fd)
+
+class HistorySnapshotter:
+    """
+    Thread saving the history to the PVC every interval.
+
+    Every server worker runs one, the last snapshot time in the shared header
+    makes only one of them write it each interval.
+    """
+
+    def __init__(self, history, path, interval=HISTORY_SNAPSHOT_INTERVAL_SEC):
+        self.history = history
+        self.path = path
+        self.interval = interval
+        self.lock = threading.Lock()
+        history.restore(path)
+        self.thread = threading.Thread(target=self._run, name="history-snapshot", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.snapshot()
+
+    def snapshot(self, force=False):
+        history = self.history
+        if not force and time.time() - float(history.snapshot_time[0]) < self.interval:
+            return
+        lock_file = open(self.path + ".lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Another worker is writing it
+            lock_file.close()
+            return
+        try:
+            history.snapshot(self.path)
+        except OSError as e:
+            print(f"Error saving sensors history: {e}", flush=True)
+        finally:
+            lock_file.close()
@@ -0,0 +1,58 @@
+#!/usr/bin/python
+# JPEGs of each frame kept by image.py at the resolutions its consumers need, encoded
+# from the decoded frame at capture time so llm.py never reads, decodes and resizes a
+# full size JPEG.
+#
+# OpenCV releases the GIL while resizing and encoding, so the variants of a frame are
+# encoded in parallel by a pool of threads shared by all the cameras.
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+
+# Variant name -> {"width": pixels, 0 keeps the frame size, "quality": JPEG quality}.
+# "full" is the one saved to disk, "llm" the one sent to the model.
+VARIANTS = json.loads(os.environ.get("IMAGE_VARIANTS", "null")) or {
+    "full": {"width": 0, "quality": 95},
+    "llm": {"width": 896, "quality": 85},
+}
+VARIANT_WORKERS = int(os.environ.get("IMAGE_VARIANT_WORKERS", 2))
+
+def encode(frame, width=0, quality=95):
+    """
+    Encode a frame as JPEG, scaled down to a width keeping the aspect ratio.
+
+    Args:
+        frame (numpy.ndarray): BGR frame
+        width (int): width in pixels, 0 or larger than the frame keeps its size
+        quality (int): JPEG quality from 0 to 100
+
+    Returns:
+        bytes: JPEG
+    """
+    if width and width < frame.shape[1]:
+        height = max(round(frame.shape[0] * width / frame.shape[1]), 1)
+        frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    ok, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("JPEG encoding failed")
+    return jpeg.tobytes()
+
+class VariantEncoder:
+    """
+    Encodes every variant of a frame in a pool of threads.
+
+    Args:
+        variants (dict): variant name -> {"width", "quality"}
+        workers (int): threads of the pool
+    """
+
+    def __init__(self, variants=VARIANTS, workers=VARIANT_WORKERS):
+        self.variants = variants
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="variants")
+
+    def encode(self, frame):
+        # Variant name -> JPEG bytes, waits for all of them
+        futures = {name: self.pool.submit(encode, frame, variant.get("width", 0), variant.get("quality", 95))
+                   for name, variant in self.variants.items()}
+        return {name: future.result() for name, future in futures.items()}
@@ -0,0 +1,62 @@
+#!/usr/bin/python
+# Decoder of the binary sensors record sent by the robot (encoder in esp32/wire.py).
+# Decoded records have the same shape as the JSON ones, so the event log and llm.py
+# do not care about the wire format.
+import struct
+
+CONTENT_TYPE = "application/x-vikare-sensors"
+
+FLAG_DISTANCE = 1
+
+BUMPERS = {0: False, 1: "right", 2: "left", 3: "front"}
+
+# Layout of every version, see esp32/wire.py
+FORMATS = {
+    1: struct.Struct("<BBHBBBBBfffB4h"),
+}
+
+def _decode_v1(fields):
+    (version, flags, year, month, day, hour, minute, second,
+     distance, battery, compass, bumpers,
+     cliff_left, cliff_front_left, cliff_front_right, cliff_right) = fields
+    # float32 on the wire, rounded so the JSON view does not show noise digits
+    return {
+        "distance": round(distance, 3) if flags & FLAG_DISTANCE else None,
+        "battery": round(battery, 3),
+        "compass": round(compass, 3),
+        "bumpers": BUMPERS.get(bumpers, "unknown"),
+        "time": "%04d-%02d-%02d-%02d-%02d-%02d" % (year, month, day, hour, minute, second),
+        "cliff": {
+            "left": cliff_left,
+            "front_left": cliff_front_left,
+            "front_right": cliff_front_right,
+            "right": cliff_right,
+        },
+    }
+
+DECODERS = {
+    1: _decode_v1,
+}
+
+def decode(data):
+    """
+    Decode one or more concatenated binary records.
+
+    Args:
+        data (bytes): request body
+
+    Returns:
+        list: records as dicts, in the same format as the JSON readings
+    """
+    readings = []
+    offset = 0
+    while offset < len(data):
+        version = data[offset]
+        if version not in FORMATS:
+            raise ValueError(f"unknown sensors record version {version}")
+        layout = FORMATS[version]
+        if offset + layout.size > len(data):
+            raise ValueError("truncated sensors record")
+        readings.append(DECODERS[version](layout.unpack_from(data, offset)))
+        offset += layout.size
+    return readings